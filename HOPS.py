@@ -1,35 +1,43 @@
 # HOPS.py
-import discord, time
+import discord
 from player_cards import PlayerCard, initialize_player_cards
 from HOPS_game import handle_challenge, get_team_data, handle_wager, wait_for_reaction, wait_for_multiple_reactions, active_wagers, active_challenges
 from HOPS_teams import create_user_team, view_team, update_team_position, change_team_name
+from HOPS_migrations import run_migrations
+from HOPS_router import CommandRouter
+from HOPS_ratelimit import RateLimiter, RateLimit
+from HOPS_interactions import interactions
+from HOPS_engine import game_odds
+from HOPS_tournament import run_tournament, fetch_standings
 from commands import (
     send_player_cards,
     view_collection,
+    view_collection_summary,
+    COLLECTION_SORTS,
+    DEFAULT_COLLECTION_SORT,
     add_user,
     send_card_stats,
-    initialize_cards_table,
     sync_player_cards_to_db,
     trade_card,
     giveaway,
+    reload_player_cards,
 )
 
-initialize_player_cards()
-initialize_cards_table()
-sync_player_cards_to_db()
-
 intents = discord.Intents.default()
 intents.message_content = True
 bot = discord.Client(intents=intents)
-
-# Cooldown dictionaries
-drop_cooldowns = {}  # For !cards command
-general_cooldowns = {}  # For all other commands
+router = CommandRouter()
 
 # Cooldown durations (in seconds)
 DROP_COOLDOWN_DURATION = 0  # 30 minutes for !cards, but I set it to  0 for testing
 GENERAL_COOLDOWN_DURATION = 0  # 5 seconds for other commands, but I set it to  0 for testing
 
+# Per-user cooldowns. The drop cooldown is saved to the database so a restart doesn't reset it.
+rate_limiter = RateLimiter({
+    'drop': RateLimit(1, DROP_COOLDOWN_DURATION, persist=True),  # For !cards command
+    'general': RateLimit(1, GENERAL_COOLDOWN_DURATION),  # For all commands
+})
+
 def clean_mention(mention):
     # Clean up the mention to ensure it only contains the numeric discord_id.
 
@@ -46,176 +54,233 @@ async def get_user_from_guild(guild, discord_id):
 async def on_ready():
     print(f'Bot is ready. Logged in as {bot.user}')
 
+@bot.event
+async def on_reaction_add(reaction, user):
+    if user == bot.user:
+        return
+    interactions.dispatch_reaction(reaction, user)
+
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
 
-    current_time = time.time()
+    # Replies to an open prompt (trade return offers, wagers, team updates) go to that prompt
+    if interactions.dispatch_message(message):
+        return
 
-    # Ensure the user exists in cooldown dictionaries
-    user_id = message.author.id
-    if user_id not in drop_cooldowns:
-        drop_cooldowns[user_id] = 0
-    if user_id not in general_cooldowns:
-        general_cooldowns[user_id] = 0
+    # Anything that isn't a registered command is ignored before any other work is done
+    matched = router.match(message.content)
+    if matched is None:
+        return
+    command, args = matched
 
     # Check general cooldown for all commands
-    if current_time - general_cooldowns[user_id] < GENERAL_COOLDOWN_DURATION:
+    if await rate_limiter.acquire('general', message.author.id):
         await message.channel.send("Please wait 5 seconds before using another command.")
         return
-    else:
-        general_cooldowns[user_id] = current_time
 
     if message.guild:
-        print(f"Message in server: {message.guild.name} - {message.channel.name} - {message.content}")
+        print(f"Command in server: {message.guild.name} - {message.channel.name} - {message.content}")
     else:
-        print(f"Message in DM: {message.content}")
-
-    # Processing the !cards command
-    if message.content.startswith('!cards'):
-        # Check the drop cooldown
-        if current_time - drop_cooldowns[user_id] < DROP_COOLDOWN_DURATION:
-            remaining_time = int(DROP_COOLDOWN_DURATION - (current_time - drop_cooldowns[user_id]))
-            minutes, seconds = divmod(remaining_time, 60)
-            await message.channel.send(f"Card drops are on cooldown. Please wait {minutes}m {seconds}s.")
-        else:
-            drop_cooldowns[user_id] = current_time  # Reset drop cooldown
-            add_user(user_id)  # Ensure the user is added to the database
-            await message.channel.send('Dropping three cards!')
-            await send_player_cards(message.channel, user_id, bot)
-
-    # Processing the !collection command
-    elif message.content.startswith('!collection'):
-        await view_collection(message.channel, user_id, bot)
-
-    # Processing the !stats command
-    elif message.content.startswith('!stats'):
-        player_name = None
-        parts = message.content.split(' ', 1)
-        if len(parts) > 1:
-            player_name = parts[1]  # The name of the player
-        await send_card_stats(message.channel, user_id, player_name)
-
-    # Processing the !team command
-    elif message.content.startswith('!create_team'):
-        parts = message.content.split()
-
-        if len(parts) < 8:  # Command should have team_name + 6 instance IDs
-            await message.channel.send(
-                "Usage: `!create_team <team_name> <instance_id_1> <instance_id_2> <instance_id_3> <instance_id_4> <instance_id_5> <instance_id_6>`")
-            return
+        print(f"Command in DM: {message.content}")
 
-        team_name = parts[1]  # First argument is the team name
-        instance_ids = parts[2:8]  # Next six arguments are the instance IDs
+    await router.dispatch(message, command, args)
 
-        response = create_user_team(user_id, team_name, instance_ids)
-        await message.channel.send(response)
+@router.command('!cards')
+async def cards_command(message, args):
+    user_id = message.author.id
+    # Check the drop cooldown
+    remaining_time = await rate_limiter.acquire('drop', user_id)
+    if remaining_time:
+        minutes, seconds = divmod(int(remaining_time), 60)
+        await message.channel.send(f"Card drops are on cooldown. Please wait {minutes}m {seconds}s.")
+    else:
+        await add_user(user_id)  # Ensure the user is added to the database
+        await message.channel.send('Dropping three cards!')
+        await send_player_cards(message.channel, user_id, bot)
+
+@router.command('!collection')
+async def collection_command(message, args):
+    # !collection [recent|serial|card] [page], or !collection summary
+    if args and args[0].lower() == "summary":
+        await view_collection_summary(message.channel, message.author.id, bot)
+        return
 
-    # Processing the !rename_team command
-    elif message.content.startswith('!rename_team'):
-        parts = message.content.split(' ', 1)
-        if len(parts) > 1:
-            new_team_name = parts[1]
-            response = change_team_name(user_id, new_team_name)
-            await message.channel.send(response)
+    sort, page = DEFAULT_COLLECTION_SORT, 1
+    for arg in args[:2]:
+        if arg.lower() in COLLECTION_SORTS:
+            sort = arg.lower()
+        elif arg.isdigit():
+            page = int(arg)
         else:
-            await message.channel.send("Please provide a new team name. Usage: `!update_team_name <new_team_name>`")
-
-    # Processing the !team update command
-    elif message.content.startswith('!update_team'):
-        await update_team_position(message, user_id, bot)
-
-    elif message.content.startswith('!view_team'):
-        response = view_team(user_id)
-        await message.channel.send(response)
-
-    # Processing the !trade command
-    elif message.content.startswith('!trade'):
-        parts = message.content.split(' ')
-        if len(parts) < 3:
-            await message.channel.send("Usage: !trade <discord_id> <instance_id> <optional_cash>")
+            await message.channel.send(f"Usage: `!collection [{'|'.join(COLLECTION_SORTS)}] [page]` or `!collection summary`")
             return
+    await view_collection(message.channel, message.author.id, bot, sort, page)
+
+@router.command('!stats')
+async def stats_command(message, args):
+    player_name = " ".join(args) if args else None  # The name of the player
+    await send_card_stats(message.channel, message.author.id, player_name)
+
+@router.command('!create_team', min_args=7,  # team_name + 6 instance IDs
+                usage="Usage: `!create_team <team_name> <instance_id_1> <instance_id_2> <instance_id_3> <instance_id_4> <instance_id_5> <instance_id_6>`")
+async def create_team_command(message, args):
+    team_name = args[0]  # First argument is the team name
+    instance_ids = args[1:7]  # Next six arguments are the instance IDs
+
+    response = await create_user_team(message.author.id, team_name, instance_ids)
+    await message.channel.send(response)
+
+@router.command('!rename_team', min_args=1,
+                usage="Please provide a new team name. Usage: `!rename_team <new_team_name>`")
+async def rename_team_command(message, args):
+    response = await change_team_name(message.author.id, " ".join(args))
+    await message.channel.send(response)
+
+@router.command('!update_team')
+async def update_team_command(message, args):
+    await update_team_position(message, message.author.id, bot)
+
+@router.command('!view_team')
+async def view_team_command(message, args):
+    response = await view_team(message.author.id)
+    await message.channel.send(response)
+
+@router.command('!trade', min_args=2, usage="Usage: !trade <discord_id> <instance_id> <optional_cash>")
+async def trade_command(message, args):
+    offer = args[1:]  # Capturing both cards and cash as part of the offer
+
+    # Clean the mention if it contains @ symbol
+    target_discord_id = clean_mention(args[0])
+
+    # Ensure target_discord_id is numeric
+    try:
+        target_discord_id = int(target_discord_id)
+    except ValueError:
+        await message.channel.send(f"Invalid Discord ID: {args[0]} is not a valid number.")
+        return
 
-        target_discord_id = parts[1]
-        offer = parts[2:]  # Capturing both cards and cash as part of the offer
+    # Get the guild where the message was sent
+    guild = message.guild
 
-        # Clean the mention if it contains @ symbol
-        target_discord_id = clean_mention(target_discord_id)
+    # Fetch target user from the guild
+    target_user = await get_user_from_guild(guild, target_discord_id)
 
-        # Ensure target_discord_id is numeric
-        try:
-            target_discord_id = int(target_discord_id)
-        except ValueError:
-            await message.channel.send(f"Invalid Discord ID: {parts[1]} is not a valid number.")
-            return
+    if target_user is None:
+        await message.channel.send(
+            f"Could not find a user with the ID {target_discord_id} in this server. Please check the discord ID and try again.")
+        return
 
-        # Get the guild where the message was sent
-        guild = message.guild
+    # Now call the trade_card function with the cleaned data
+    await trade_card(message, target_user, " ".join(offer), bot)  # Pass bot instance here
+
+@router.command('!giveaway', min_args=2, usage="Usage: !giveaway @target_user <cards/cash>")
+async def giveaway_command(message, args):
+    target_user = message.mentions[0]  # The user being mentioned
+    giveaway_details = " ".join(args[1:])  # The rest of the message is the giveaway details
+    # Call the giveaway function from commands.py
+    await giveaway(message, target_user, giveaway_details, bot)
+
+@router.command('!reload_cards')
+async def reload_cards_command(message, args):
+    # Admin only: reload the card catalog without restarting the bot
+    if not getattr(message.author, "guild_permissions", None) or not message.author.guild_permissions.administrator:
+        await message.channel.send("Only server administrators can reload the card catalog.")
+        return
+    try:
+        added, changed, removed, rows = await reload_player_cards()
+    except Exception as e:
+        print(f"Error reloading cards: {e}")
+        await message.channel.send(f"Card reload failed: {e}")
+        return
+    await message.channel.send(
+        f"Card catalog reloaded: {added} added, {changed} changed, {removed} removed ({rows} rows synced).")
 
-        # Fetch target user from the guild
-        target_user = await get_user_from_guild(guild, target_discord_id)
+@router.command('!challenge', min_args=1, usage="Usage: `!challenge @User`")
+async def challenge_command(message, args):
+    # Get the target user (the person being challenged)
+    target_user = message.mentions[0]
 
-        if target_user is None:
-            await message.channel.send(
-                f"Could not find a user with the ID {target_discord_id} in this server. Please check the discord ID and try again.")
-            return
+    # Get the Discord ID of the challenger (the user sending the challenge)
+    challenger_discord_id = message.author.id
 
-        # Now call the trade_card function with the cleaned data
-        await trade_card(message, target_user, " ".join(offer), bot)  # Pass bot instance here
+    # Get the team data for the challenger (team1)
+    team1_name, team1_data = await get_team_data(challenger_discord_id)
 
-    # Processing the !give command
-    elif message.content.startswith("!giveaway"):
-        # Parse target user and giveaway details
-        args = message.content.split(" ")
-        if len(args) < 3:
-            await message.channel.send("Usage: !giveaway @target_user <cards/cash>")
-            return
-        target_user = message.mentions[0]  # The user being mentioned
-        giveaway_details = " ".join(args[2:])  # The rest of the message is the giveaway details
-        # Call the giveaway function from commands.py
-        await giveaway(message, target_user, giveaway_details, bot)
-
-    elif message.content.startswith("!challenge"):
-        args = message.content.split(" ")
-        if len(args) < 2:
-            await message.channel.send("Usage: `!challenge @User`")
-            return
+    if team1_data is None:
+        await message.channel.send(f"Could not find your team, {message.author.name}.")
+        return
 
-        # Get the target user (the person being challenged)
-        target_user = message.mentions[0]
+    # Get the team data for the opponent (team2)
+    target_discord_id = target_user.id
+    team2_name, team2_data = await get_team_data(target_discord_id)
 
-        # Get the Discord ID of the challenger (the user sending the challenge)
-        challenger_discord_id = message.author.id
+    if team2_data is None:
+        await message.channel.send(f"Could not find {target_user.name}'s team.")
+        return
 
-        # Get the team data for the challenger (team1)
-        team1_name, team1_data = get_team_data(challenger_discord_id)
+    # This was just for debugging challenges
+    print(f"Challenger Team ({team1_name}):")
 
-        if team1_data is None:
-            await message.channel.send(f"Could not find your team, {message.author.name}.")
-            return
+    for player in team1_data.players:
+        print(f"  {player.player_name} - Off: {player.offensive_rating}, Def: {player.defensive_rating}")
 
-        # Get the team data for the opponent (team2)
-        target_discord_id = target_user.id
-        team2_name, team2_data = get_team_data(target_discord_id)
+    print(f"Opponent Team ({team2_name}):")
 
-        if team2_data is None:
-            await message.channel.send(f"Could not find {target_user.name}'s team.")
-            return
+    for player in team2_data.players:
+        print(f"  {player.player_name} - Off: {player.offensive_rating}, Def: {player.defensive_rating}")
 
-        # This was just for debugging challenges
-        print(f"Challenger Team ({team1_name}):")
+    # Proceed with handling the challenge, passing team data
+    await handle_challenge(bot, message, target_user, team1_name, team1_data, team2_name, team2_data)
 
-        for player in team1_data:
-            print(f"  {player['player_name']} - Off: {player['offensive_rating']}, Def: {player['defensive_rating']}")
+@router.command('!odds', min_args=1, usage="Usage: `!odds @User`")
+async def odds_command(message, args):
+    # Simulates games between your team and the mentioned user's without playing them
+    if not message.mentions:
+        await message.channel.send("Usage: `!odds @User`")
+        return
+    target_user = message.mentions[0]
 
-        print(f"Opponent Team ({team2_name}):")
+    team1_name, team1_data = await get_team_data(message.author.id)
+    if team1_data is None:
+        await message.channel.send(f"Could not find your team, {message.author.name}.")
+        return
 
-        for player in team2_data:
-            print(f"  {player['player_name']} - Off: {player['offensive_rating']}, Def: {player['defensive_rating']}")
+    team2_name, team2_data = await get_team_data(target_user.id)
+    if team2_data is None:
+        await message.channel.send(f"Could not find {target_user.name}'s team.")
+        return
 
-        # Proceed with handling the challenge, passing team data
-        await handle_challenge(bot, message, target_user, team1_name, team1_data, team2_name, team2_data)
+    odds = game_odds(team1_data, team2_data)
+    await message.channel.send(
+        f"**{team1_name}** vs **{team2_name}** over {odds.games} simulated games:\n"
+        f"{message.author.name} wins {odds.win_probability:.1%} of the time. "
+        f"Expected spread: {odds.mean_spread:+.1f} points "
+        f"(80% of games between {odds.spread_low:+.1f} and {odds.spread_high:+.1f}).")
+
+@router.command('!tournament')
+async def tournament_command(message, args):
+    # Admin only: play a round robin between every team and post the top of the standings
+    if not getattr(message.author, "guild_permissions", None) or not message.author.guild_permissions.administrator:
+        await message.channel.send("Only server administrators can run a tournament.")
+        return
+    tournament_id, teams, games = await run_tournament()
+    if tournament_id is None:
+        await message.channel.send("A tournament needs at least two teams.")
+        return
 
-bot.run('bot token replaced')
+    content = f"**Tournament {tournament_id}: {teams} teams, {games} games**\n"
+    for rank, team_name, wins, losses, points_for, points_against in await fetch_standings(tournament_id):
+        content += f"{rank}. {team_name} {wins}-{losses} ({points_for:.0f}-{points_against:.0f})\n"
+    await message.channel.send(content)
+
+# Startup only runs when HOPS.py is the main script. The image render workers re-import this
+# module when they spawn, and must not reload the cards or start a second bot.
+if __name__ == '__main__':
+    initialize_player_cards()
+    run_migrations()
+    rate_limiter.prune_saved()
+    print(f"Synced {sync_player_cards_to_db()} changed cards to the database")
+    bot.run('bot token replaced')
 
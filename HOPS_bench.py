@@ -0,0 +1,401 @@
+# HOPS_bench.py
+import os, sys, json, time, random, asyncio, argparse, tempfile
+from PIL import Image
+from HOPS_db import db
+from HOPS_migrations import run_migrations
+from HOPS_fake_discord import FakeClient, FakeUser, FakeGuild, FakeChannel, react, reply
+from HOPS_images import renderer, image_cache_stats, CARD_IMAGE_SIZE
+from HOPS_game import get_team_data, handle_challenge
+from HOPS_teams import view_team
+from player_cards import PlayerCard, initialize_player_cards
+from commands import (
+    add_user,
+    send_player_cards,
+    view_collection,
+    trade_card,
+    sync_player_cards_to_db,
+    encode_base62,
+    refresh_team_ratings,
+)
+
+# Benchmarks for the command handlers at scale. `generate` builds a synthetic database with the
+# real schema; `run` drives the handlers in commands.py, HOPS_teams.py and HOPS_game.py against
+# it through HOPS_fake_discord, playing the other users' reactions and replies, and reports
+# latency percentiles and throughput per command. Everything is seeded, so two runs with the
+# same arguments do the same work.
+#
+#   python HOPS_bench.py generate --db bench.db --users 100000 --cards-per-user 100
+#   python HOPS_bench.py run --db bench.db --iterations 200 --concurrency 8 --json results.json
+#
+# With --baseline, `run` exits with status 1 if any command's p99 is more than --tolerance worse
+# than in the baseline results, so CI can catch regressions.
+
+BENCH_COMMANDS = ("cards", "collection", "view_team", "trade", "challenge")
+BENCH_DISCORD_ID_BASE = 5 * 10 ** 17  # Generated users' discord IDs start here, clear of fake snowflakes
+GENERATE_BATCH = 100000  # user_cards rows per insert transaction
+COLLECTION_SIZE_SKEW = 1.5  # Pareto shape of collection sizes; lower gives heavier collectors
+MAX_COLLECTION_SIZE = 100000
+CONDITIONS = ("Injured", "Injury Watch", "Healthy", "Peak Condition")
+CONDITION_WEIGHTS = (0.1, 0.15, 0.7, 0.05)
+
+
+def use_placeholder_images(directory):
+    # The card art isn't in the repo. Cards whose image file is missing get a plain image instead,
+    # so !cards still renders and claims.
+    for card in PlayerCard.cards:
+        if os.path.exists(card.image_path):
+            continue
+        path = os.path.join(directory, f"card{card.card_id}.png")
+        if not os.path.exists(path):
+            Image.new("RGB", CARD_IMAGE_SIZE, (card.card_id * 37 % 256, 90, 160)).save(path)
+        card.image_path = path
+
+
+def generate_database(users, cards_per_user, team_fraction, seed):
+    # Fills the database at db.path with `users` users owning about users * cards_per_user card
+    # instances between them. Collection sizes are skewed, so a few users own tens of thousands
+    # of cards. team_fraction of the users who own six different cards get a team.
+    rng = random.Random(seed)
+    run_migrations()
+    sync_player_cards_to_db()
+
+    with db.writer() as conn:
+        if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+            raise SystemExit(f"{db.path} already has users; generate into a new file.")
+        cards = conn.execute('SELECT card_id, offensive_rating, defensive_rating, attributes FROM cards').fetchall()
+        conn.executemany('INSERT INTO users (user_id, discord_id, court_cash) VALUES (?, ?, ?)',
+                         [(user_id, str(BENCH_DISCORD_ID_BASE + user_id), rng.randrange(10000))
+                          for user_id in range(1, users + 1)])
+
+    weights = [rng.paretovariate(COLLECTION_SIZE_SKEW) for _ in range(users)]
+    scale = users * cards_per_user / sum(weights)
+    sizes = [min(MAX_COLLECTION_SIZE, round(weight * scale)) for weight in weights]
+
+    serials = {card[0]: 0 for card in cards}
+    lineups = {}
+    instance = 0
+    batch = []
+    started = time.perf_counter()
+
+    def flush():
+        with db.writer() as conn:
+            conn.executemany('''
+                INSERT INTO user_cards (instance_id, user_id, card_id, instance_number, condition,
+                                        offensive_rating, defensive_rating, attributes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+        batch.clear()
+
+    for user_id, size in enumerate(sizes, start=1):
+        lineup = {}  # card_id -> instance_id, the first copy of up to six different cards
+        for condition in rng.choices(CONDITIONS, CONDITION_WEIGHTS, k=size):
+            card_id, offensive_rating, defensive_rating, attributes = rng.choice(cards)
+            serials[card_id] += 1
+            instance_id = encode_base62(instance)
+            instance += 1
+            batch.append((instance_id, user_id, card_id, serials[card_id], condition,
+                          offensive_rating, defensive_rating, attributes))
+            if len(lineup) < 6:
+                lineup.setdefault(card_id, instance_id)
+        if len(lineup) == 6 and rng.random() < team_fraction:
+            lineups[user_id] = list(lineup.values())
+        if len(batch) >= GENERATE_BATCH:
+            flush()
+            print(f"  {instance} cards ({time.perf_counter() - started:.0f}s)", end="\r")
+    flush()
+    print(f"  {instance} cards ({time.perf_counter() - started:.0f}s)")
+
+    with db.writer() as conn:
+        # Counters and aggregates the bot keeps up to date, as the migrations would backfill them
+        conn.executemany('INSERT OR REPLACE INTO card_serials (card_id, last_serial) VALUES (?, ?)', serials.items())
+        conn.execute("INSERT OR REPLACE INTO id_sequences (name, value) VALUES ('instance_id', ?)", (instance - 1,))
+        conn.execute('''
+            INSERT INTO user_card_counts (user_id, card_id, condition, count)
+            SELECT user_id, card_id, condition, COUNT(*) FROM user_cards GROUP BY user_id, card_id, condition
+        ''')
+        conn.executemany('''
+            INSERT INTO teams (user_id, team_name, point_guard, shooting_guard, small_forward, power_forward, center, sixth_man)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(user_id, f"Team {user_id}", *lineup) for user_id, lineup in lineups.items()])
+        refresh_team_ratings(conn)
+        conn.execute('ANALYZE')
+
+    return users, instance, len(lineups)
+
+
+class BenchContext:
+    # Shared state for one benchmark run: the fake client and guild, the seeded RNG that picks
+    # users, and the background tasks that play the other side of each conversation.
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.client = FakeClient()
+        self.guild = FakeGuild()
+        self.tasks = set()
+        with db.reader() as conn:
+            self.discord_ids = [int(row[0]) for row in conn.execute(
+                'SELECT discord_id FROM users WHERE user_id IN (SELECT DISTINCT user_id FROM user_card_counts)')]
+            self.team_discord_ids = [int(row[0]) for row in conn.execute(
+                'SELECT users.discord_id FROM teams JOIN users ON users.user_id = teams.user_id')]
+        if len(self.discord_ids) < 2:
+            raise SystemExit(f"{db.path} has no generated collections; run `generate` first.")
+
+    def user(self, with_team=False):
+        discord_id = self.rng.choice(self.team_discord_ids if with_team else self.discord_ids)
+        member = FakeUser(discord_id)
+        self.guild.members[discord_id] = member
+        return member
+
+    def user_pair(self, with_team=False):
+        first = self.user(with_team)
+        second = self.user(with_team)
+        while second == first:
+            second = self.user(with_team)
+        return first, second
+
+    def spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def channel(self, rules):
+        # A channel whose scripted users answer the bot. rules are (text, action) pairs; the first
+        # rule whose text appears in a message the bot sends has its action(message) spawned.
+        def respond(message):
+            for text, action in rules:
+                if (message.file is not None) if text is None else (text in message.content):
+                    self.spawn(action(message))
+                    return
+        return FakeChannel(self.client.user, self.guild, responder=respond)
+
+
+async def both(*coros):
+    # Runs two players' answers together, as one scripted action
+    await asyncio.gather(*coros)
+
+
+# Each scenario does its setup, then returns a coroutine function that runs the command once.
+# Only that coroutine is timed.
+
+async def bench_cards(ctx):
+    user = ctx.user()
+    channel = ctx.channel([(None, lambda message: react(message, "1️⃣", user))])
+
+    async def run():
+        await add_user(user.id)
+        await send_player_cards(channel, user.id, ctx.client)
+    return run
+
+
+async def bench_collection(ctx):
+    # Time to the first page plus one page flip
+    user = ctx.user()
+    first_page = asyncio.get_running_loop().create_future()
+    channel = ctx.channel([("", lambda message: _resolve(first_page, message))])
+
+    async def run():
+        session = asyncio.create_task(view_collection(channel, user.id, ctx.client))
+        try:
+            message = await first_page
+            if "Page 1/1:" not in message.content and "Page" in message.content:
+                await react(message, "▶️", user)
+                await message.edited.wait()
+        finally:
+            session.cancel()
+    return run
+
+
+async def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+async def bench_view_team(ctx):
+    user = ctx.user(with_team=True)
+
+    async def run():
+        await view_team(user.id)
+    return run
+
+
+def first_instance(conn, discord_id):
+    # Any card instance the user owns, to put in a trade offer
+    row = conn.execute('''
+        SELECT instance_id FROM user_cards
+        WHERE user_id = (SELECT user_id FROM users WHERE discord_id = ?) LIMIT 1
+    ''', (discord_id,)).fetchone()
+    return row[0] if row else None
+
+
+async def bench_trade(ctx):
+    # A card for a card, through the offer, return offer and final confirmation
+    sender, target = ctx.user_pair()
+    sender_card = await db.read(first_instance, sender.id)
+    target_card = await db.read(first_instance, target.id)
+    channel = ctx.channel([
+        ("Do you accept or decline?", lambda message: react(message, "✅", target)),
+        ("input your return offer", lambda message: reply(channel, target, f"!return {target_card}")),
+        ("Do both players accept?", lambda message: both(react(message, "✅", sender), react(message, "✅", target))),
+    ])
+    message = channel.message(sender, f"!trade {target.mention} {sender_card}", mentions=[target])
+
+    async def run():
+        await trade_card(message, target, sender_card, ctx.client)
+    return run
+
+
+async def bench_challenge(ctx):
+    # A full game: challenge, wager, both offers, and all four quarters
+    challenger, target = ctx.user_pair(with_team=True)
+
+    def play(message):
+        active = target if target.mention in message.content else challenger
+        return react(message, "1️⃣", active)
+
+    channel = ctx.channel([
+        ("has challenged you", lambda message: react(message, "✅", target)),
+        ("would you like to make a wager", lambda message: both(react(message, "✅", challenger), react(message, "✅", target))),
+        ("To make an offer", lambda message: both(reply(channel, challenger, "!wager $10"), reply(channel, target, "!wager $10"))),
+        ("Do both players accept these terms", lambda message: both(react(message, "✅", challenger), react(message, "✅", target))),
+        ("Middle of Q", play),
+    ])
+    message = channel.message(challenger, f"!challenge {target.mention}", mentions=[target])
+
+    async def run():
+        team1_name, team1_data = await get_team_data(challenger.id)
+        team2_name, team2_data = await get_team_data(target.id)
+        await handle_challenge(ctx.client, message, target, team1_name, team1_data, team2_name, team2_data)
+    return run
+
+
+SCENARIOS = {
+    "cards": bench_cards,
+    "collection": bench_collection,
+    "view_team": bench_view_team,
+    "trade": bench_trade,
+    "challenge": bench_challenge,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def bench_command(ctx, scenario, iterations, concurrency):
+    latencies = []
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with slots:
+            run = await scenario(ctx)
+            start = time.perf_counter()
+            try:
+                await run()
+            except Exception as e:
+                errors += 1
+                print(f"  {scenario.__name__} failed: {e!r}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(iterations)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+async def run_benchmarks(commands, iterations, concurrency, seed):
+    random.seed(seed)  # Drops, conditions and game coin flips use the module RNG
+    ctx = BenchContext(seed)
+    results = {}
+    for command in commands:
+        results[command] = await bench_command(ctx, SCENARIOS[command], iterations, concurrency)
+        stats = results[command]
+        print(f"{command:<12} p50 {stats['p50_ms']:8.2f} ms   p99 {stats['p99_ms']:8.2f} ms   "
+              f"{stats['throughput_per_s']:8.1f}/s   errors {stats['errors']}")
+    print(format_image_cache_stats(image_cache_stats()))
+    for task in list(ctx.tasks):
+        task.cancel()
+    return results
+
+
+def format_image_cache_stats(stats):
+    # One line from HOPS_images.image_cache_stats(): hit rates of the rendered PNG caches and the render queue
+    caches = "   ".join(f"{name} {cache['hit_rate']:.1%} of {cache['hits'] + cache['misses']} ({cache['size']} cached)"
+                       for name, cache in (("drop", stats["drop"]), ("card", stats["card"])))
+    return f"image caches: {caches}   render queue {stats['render_queue']}"
+
+
+def regressions(results, baseline, tolerance):
+    # Commands whose p99 got more than `tolerance` (a fraction) slower than in baseline
+    return [
+        command for command, stats in results.items()
+        if command in baseline and stats["p99_ms"] > baseline[command]["p99_ms"] * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HOPS command handlers against a synthetic database.")
+    parser.add_argument('--db', default='HOPS_bench.db', help="Database file to generate or benchmark")
+    parser.add_argument('--seed', type=int, default=1)
+    subcommands = parser.add_subparsers(dest='action', required=True)
+
+    generate = subcommands.add_parser('generate', help="Build a synthetic database")
+    generate.add_argument('--users', type=int, default=100000)
+    generate.add_argument('--cards-per-user', type=int, default=100)
+    generate.add_argument('--team-fraction', type=float, default=0.5)
+
+    run = subcommands.add_parser('run', help="Benchmark the commands")
+    run.add_argument('--commands', nargs='+', choices=BENCH_COMMANDS, default=list(BENCH_COMMANDS))
+    run.add_argument('--iterations', type=int, default=200, help="Runs of each command")
+    run.add_argument('--concurrency', type=int, default=1, help="Runs of a command in flight at once")
+    run.add_argument('--images', help="Directory for placeholder card images (default: a temporary directory)")
+    run.add_argument('--json', help="Write the results here")
+    run.add_argument('--baseline', help="Results JSON from an earlier run to compare against")
+    run.add_argument('--tolerance', type=float, default=0.25, help="Allowed p99 slowdown against the baseline")
+    options = parser.parse_args()
+
+    db.path = options.db
+    initialize_player_cards()
+
+    if options.action == 'generate':
+        started = time.perf_counter()
+        users, cards, teams = generate_database(options.users, options.cards_per_user, options.team_fraction, options.seed)
+        print(f"Generated {users} users, {cards} cards and {teams} teams in {time.perf_counter() - started:.0f}s")
+        return 0
+
+    run_migrations()
+    with tempfile.TemporaryDirectory() as images:
+        use_placeholder_images(options.images or images)
+        try:
+            results = asyncio.run(run_benchmarks(options.commands, options.iterations, options.concurrency, options.seed))
+        finally:
+            renderer.shutdown()
+            db.close()
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if options.baseline:
+        with open(options.baseline) as f:
+            slower = regressions(results, json.load(f), options.tolerance)
+        if slower:
+            print(f"p99 regressed by more than {options.tolerance:.0%}: {', '.join(slower)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# HOPS_cache.py
+import threading
+from collections import OrderedDict
+
+ROSTER_CACHE_SIZE = 10000  # Teams kept in memory for !challenge
+TEAM_TEXT_CACHE_SIZE = 10000  # Rendered !view_team messages kept in memory
+
+
+class LRUCache:
+    # Bounded least-recently-used cache with hit/miss counters. Safe to share between the
+    # event loop and the DB threads.
+    #
+    # Every pop()/clear() bumps `version`. A loader that reads the version before going to the
+    # database and passes it to put() will not store a value that was invalidated mid-load.
+    #
+    # With a weigher (e.g. len for bytes values) the cache is also bounded by total weight.
+
+    def __init__(self, maxsize, maxweight=None, weigher=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                return  # Invalidated while the value was being loaded
+            if key in self._data:
+                self.weight -= self._weigh(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.weight += self._weigh(value)
+            while len(self._data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                _, evicted = self._data.popitem(last=False)
+                self.weight -= self._weigh(evicted)
+
+    def pop(self, key):
+        with self._lock:
+            self.version += 1
+            value = self._data.pop(key, None)
+            if value is not None:
+                self.weight -= self._weigh(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+            self.weight = 0
+
+    def _weigh(self, value):
+        return self.weigher(value) if self.weigher else 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "weight": self.weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+# Team rosters for get_team_data, keyed by discord_id
+roster_cache = LRUCache(ROSTER_CACHE_SIZE)
+
+# Rendered !view_team text, keyed by discord_id
+team_text_cache = LRUCache(TEAM_TEXT_CACHE_SIZE)
+
+
+def invalidate_team(*discord_ids):
+    # Drops cached team data for these users. Call after anything that changes a lineup,
+    # the team name, or which cards a user owns.
+    for discord_id in discord_ids:
+        roster_cache.pop(discord_id)
+        team_text_cache.pop(discord_id)
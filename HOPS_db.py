@@ -0,0 +1,121 @@
+# HOPS_db.py
+import sqlite3, threading, queue, asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DATABASE_NAME = 'HOPS_prototype1.db'
+READ_POOL_SIZE = 4  # Number of read connections kept open
+BUSY_TIMEOUT_MS = 10000  # How long SQLite waits on a locked database before giving up
+LOCK_RETRIES = 5  # Extra attempts for a write that still finds the database locked
+
+
+class ConnectionManager:
+    # Keeps one long-lived writer connection plus a small pool of read connections.
+    # WAL mode lets the readers keep working while the writer holds its lock, so a slow
+    # write never stalls !cards or !view_team lookups.
+    #
+    # Coroutines should use `await db.read(fn, ...)` / `await db.write(fn, ...)`, which call
+    # fn(conn, ...) on the DB threads so the event loop keeps handling gateway events while
+    # SQLite does disk I/O. The writer runs on a single dedicated thread, so writes are
+    # serialized in submission order.
+
+    def __init__(self, path=DATABASE_NAME, read_pool_size=READ_POOL_SIZE):
+        self.path = path
+        self.read_pool_size = read_pool_size
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._pool_lock = threading.Lock()
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='HOPS-db-writer')
+        self._read_executor = ThreadPoolExecutor(max_workers=read_pool_size, thread_name_prefix='HOPS-db-reader')
+
+    def _open(self, read_only=False):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        if not read_only:
+            conn.execute('PRAGMA journal_mode = WAL')  # Persistent, only needs setting by the writer
+        conn.execute('PRAGMA synchronous = NORMAL')  # Safe with WAL, skips an fsync per commit
+        conn.execute('PRAGMA temp_store = MEMORY')
+        if read_only:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    @contextmanager
+    def writer(self):
+        # Yields the single writer connection. Commits on success and rolls back on error.
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._open()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        # Borrows a read connection from the pool, opening a new one while the pool is below its size.
+        conn = None
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                if self._reader_count < self.read_pool_size:
+                    self._reader_count += 1
+                    conn = self._open(read_only=True)
+            if conn is None:
+                conn = self._readers.get()  # Pool exhausted, wait for a connection to come back
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()  # Never hand back a connection holding a stale snapshot
+            self._readers.put(conn)
+
+    async def read(self, fn, *args):
+        # Runs fn(conn, *args) on a pooled read connection without blocking the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._run_read, fn, args)
+
+    async def write(self, fn, *args):
+        # Runs fn(conn, *args) inside a write transaction on the writer thread
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor, self._run_write, fn, args)
+
+    def _run_read(self, fn, args):
+        with self.reader() as conn:
+            return fn(conn, *args)
+
+    def _run_write(self, fn, args):
+        # The busy_timeout already waits out short locks. If the database is still locked
+        # (e.g. a long external backup), back off and retry on this thread, not the event loop.
+        delay = 0.05
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                with self.writer() as conn:
+                    return fn(conn, *args)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == LOCK_RETRIES:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def close(self):
+        # Closes every connection. The manager reopens them lazily if used again.
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._pool_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reader_count = 0
+
+
+db = ConnectionManager()
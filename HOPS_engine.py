@@ -0,0 +1,82 @@
+# HOPS_engine.py
+import numpy as np
+from typing import NamedTuple
+
+# The scoring rules of a game, with no Discord in them, so games can be simulated as well as
+# played. HOPS_game.run_game plays one game quarter by quarter; simulate_games plays thousands
+# at once with NumPy (play_games), for !odds and tournaments.
+
+QUARTERS = 4
+CHOICE_BONUS = 3  # Points for the team whose side of the quarter's coin flip comes up
+SIMULATED_GAMES = 10000  # Games played per !odds
+
+
+class GameOdds(NamedTuple):
+    games: int
+    win_probability: float  # Chance team 1 wins. Ties go to team 2, as in run_game.
+    mean_spread: float  # Average of team 1's score minus team 2's
+    spread_low: float  # 10th percentile of the spread
+    spread_high: float  # 90th percentile of the spread
+
+
+def quarter_multiplier(quarter):
+    # Scales a team's offense by quarter. quarter counts from 0, as in run_game.
+    if quarter == 1:
+        return 1 / 3
+    elif quarter == 2:
+        return 1.05 / 2
+    elif quarter == 3:
+        return 9.5 / 12
+    else:
+        return 1
+
+
+def calculate_quarter_score(team_off, opponent_def, quarter, correct_choice):
+    # Calculates the score for a given quarter based on team ratings, quarter formula, and correctness of player choice.
+
+    # Calculate the base score
+    base_score = ((team_off / 12) * quarter_multiplier(quarter)) - (opponent_def / 200)
+
+    # Adjust score based on whether the player made a correct choice
+    score_variation = CHOICE_BONUS if correct_choice else 0
+
+    # Calculate final quarter score
+    final_score = base_score + score_variation
+
+    # Ensure the score never decreases
+    return max(final_score, 0)  # Prevent negative scores
+
+
+QUARTER_MULTIPLIERS = np.array([quarter_multiplier(quarter) for quarter in range(QUARTERS)])
+
+
+def play_games(team1_off, team1_def, team2_off, team2_def, games, rng):
+    # Plays `games` games at once with calculate_quarter_score's formula. Ratings are either
+    # numbers or arrays with one entry per game. Returns two arrays with each game's final score
+    # for team 1 and team 2; ties go to team 2.
+    team1_off, team1_def, team2_off, team2_def = (np.reshape(rating, (-1, 1)) for rating in
+                                                  (team1_off, team1_def, team2_off, team2_def))
+
+    # One coin flip per quarter decides which team gets the bonus, as in run_game
+    team1_correct = rng.random((games, QUARTERS)) < 0.5
+    team1_scores = np.maximum((team1_off / 12) * QUARTER_MULTIPLIERS - team2_def / 200
+                              + CHOICE_BONUS * team1_correct, 0).sum(axis=1)
+    team2_scores = np.maximum((team2_off / 12) * QUARTER_MULTIPLIERS - team1_def / 200
+                              + CHOICE_BONUS * ~team1_correct, 0).sum(axis=1)
+    return team1_scores, team2_scores
+
+
+def simulate_games(team1_data, team2_data, games=SIMULATED_GAMES, rng=None):
+    # Plays `games` games between two teams (HOPS_teams.TeamData) in one pass, with the same
+    # stored ratings run_game uses. Returns two arrays with each game's final score for team 1 and team 2.
+    rng = rng if rng is not None else np.random.default_rng()
+    return play_games(team1_data.offensive_total, team1_data.defensive_total,
+                      team2_data.offensive_total, team2_data.defensive_total, games, rng)
+
+
+def game_odds(team1_data, team2_data, games=SIMULATED_GAMES, rng=None):
+    team1_scores, team2_scores = simulate_games(team1_data, team2_data, games, rng)
+    spread = team1_scores - team2_scores
+    spread_low, spread_high = np.percentile(spread, [10, 90])
+    return GameOdds(games, float(np.mean(team1_scores > team2_scores)), float(spread.mean()),
+                    float(spread_low), float(spread_high))
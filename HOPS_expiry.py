@@ -0,0 +1,73 @@
+# HOPS_expiry.py
+import asyncio, heapq, itertools
+
+EXPIRY_TICK = 1.0  # Longest the scheduler sleeps; expiries due within one tick are run together
+
+
+class ExpiryScheduler:
+    # One background task expires every drop, trade, challenge and prompt instead of each one
+    # keeping its own timer or timestamp. Deadlines sit in a heap; cancelling only forgets the
+    # callback, and the heap is compacted once cancelled entries outnumber live ones, so memory
+    # stays proportional to what is actually pending.
+    #
+    # Everything that falls due in the same tick is run as one batch with asyncio.gather, on its
+    # own task so a slow Discord edit never holds up the next batch.
+
+    def __init__(self, tick=EXPIRY_TICK):
+        self.tick = tick
+        self._heap = []  # (deadline, handle)
+        self._pending = {}  # handle -> (callback, args)
+        self._handles = itertools.count()
+        self._task = None
+        self._batches = set()
+
+    def schedule(self, delay, callback, *args):
+        # Runs `await callback(*args)` after delay seconds unless cancelled. Returns a handle for cancel().
+        loop = asyncio.get_running_loop()
+        handle = next(self._handles)
+        self._pending[handle] = (callback, args)
+        heapq.heappush(self._heap, (loop.time() + delay, handle))
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._compact()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        return handle
+
+    def cancel(self, handle):
+        # Returns True if the callback had not run yet
+        return self._pending.pop(handle, None) is not None
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[1] in self._pending]
+        heapq.heapify(self._heap)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            now = loop.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                _, handle = heapq.heappop(self._heap)
+                entry = self._pending.pop(handle, None)
+                if entry is not None:
+                    due.append(entry)
+            if due:
+                batch = loop.create_task(self._run_batch(due))
+                self._batches.add(batch)
+                batch.add_done_callback(self._batches.discard)
+            if not self._pending:
+                break
+            await asyncio.sleep(min(self.tick, max(0, self._heap[0][0] - now)))
+        self._heap.clear()
+
+    async def _run_batch(self, due):
+        results = await asyncio.gather(*(callback(*args) for callback, args in due), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error in expiry callback: {result}")
+
+    def __len__(self):
+        return len(self._pending)
+
+
+expiry = ExpiryScheduler()
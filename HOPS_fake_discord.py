@@ -0,0 +1,141 @@
+# HOPS_fake_discord.py
+import asyncio, itertools
+from HOPS_interactions import interactions
+
+# Local stand-ins for the parts of discord.py the command handlers use, so the handlers can be
+# driven by benchmarks and load tests without a gateway connection. Nothing here talks to Discord.
+#
+# A FakeChannel calls its `responder` with every message the bot sends. Benchmarks use it to
+# play the other side of a conversation: react to a prompt, or reply to it with a message.
+
+_snowflakes = itertools.count(10 ** 17)
+DELIVERY_ATTEMPTS = 1000  # Loop iterations a scripted reaction or reply waits for its prompt to listen
+
+
+def snowflake():
+    return next(_snowflakes)
+
+
+class FakeUser:
+    def __init__(self, user_id=None, name=None, administrator=False):
+        self.id = user_id if user_id is not None else snowflake()
+        self.name = name or f"user{self.id}"
+        self.bot = False
+        self.guild_permissions = FakePermissions(administrator)
+        self.sent = []  # Direct messages
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"FakeUser({self.id})"
+
+
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class FakeGuild:
+    def __init__(self, name="HOPS bench", members=()):
+        self.id = snowflake()
+        self.name = name
+        self.members = {member.id: member for member in members}
+
+    async def fetch_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeReaction:
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content="", file=None, mentions=()):
+        self.id = snowflake()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content or ""
+        self.file = file
+        self.mentions = list(mentions)
+        self.reactions = []
+        self.edits = 0
+        self.edited = asyncio.Event()
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def remove_reaction(self, emoji, user):
+        pass
+
+    async def clear_reactions(self):
+        self.reactions.clear()
+
+    async def edit(self, content=None, **kwargs):
+        if content is not None:
+            self.content = content
+        self.edits += 1
+        self.edited.set()
+
+
+class FakeChannel:
+    def __init__(self, bot_user, guild=None, name="bench", responder=None):
+        self.id = snowflake()
+        self.name = name
+        self.guild = guild
+        self.bot_user = bot_user
+        self.responder = responder  # Called as responder(message) for every message the bot sends
+        self.sent = 0
+        self.last_message = None
+
+    async def send(self, content=None, file=None, **kwargs):
+        message = FakeMessage(self, self.bot_user, content, file)
+        self.sent += 1
+        self.last_message = message
+        if self.responder is not None:
+            self.responder(message)
+        return message
+
+    def message(self, author, content, mentions=()):
+        # A message from a user in this channel, as on_message would receive it
+        return FakeMessage(self, author, content, mentions=mentions)
+
+
+class FakeClient:
+    # Stands in for discord.Client: the handlers only read bot.user
+    def __init__(self):
+        self.user = FakeUser(name="HOPS")
+        self.user.bot = True
+
+
+async def react(message, emoji, user):
+    # Adds a reaction as user once something is waiting for it. Prompts start listening only after
+    # adding their own reactions, so a reaction sent straight away would otherwise be missed.
+    for _ in range(DELIVERY_ATTEMPTS):
+        if interactions.dispatch_reaction(FakeReaction(message, emoji), user):
+            return True
+        await asyncio.sleep(0)
+    return False
+
+
+async def reply(channel, user, content):
+    # Sends a message as user once a prompt is waiting for one from them in channel
+    message = channel.message(user, content)
+    for _ in range(DELIVERY_ATTEMPTS):
+        if interactions.dispatch_message(message):
+            return True
+        await asyncio.sleep(0)
+    return False
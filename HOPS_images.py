@@ -0,0 +1,161 @@
+# HOPS_images.py
+import io, os, asyncio, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from PIL import Image
+from HOPS_cache import LRUCache
+
+# Encoded PNGs are a few hundred KB each, so the caches are bounded by bytes as well as entries
+DROP_IMAGE_CACHE_SIZE = 8000  # About every ordered triple of a 21 card catalog
+DROP_IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+CARD_IMAGE_CACHE_SIZE = 1000
+CARD_IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Rendering runs in worker processes so compositing and PNG encoding never block the event loop.
+# Set RENDER_USE_PROCESSES to False to use threads instead (PIL releases the GIL while it works).
+# Workers are spawned, not forked: the pool starts after the database threads are running, and
+# forking a process with threads can copy a lock that some other thread holds.
+RENDER_WORKERS = os.cpu_count() or 2
+RENDER_QUEUE_LIMIT = 64  # Renders queued or running at once before new ones are turned away
+RENDER_USE_PROCESSES = True
+WORKER_IMAGE_CACHE_SIZE = 64  # Decoded source images kept by each worker
+
+CARD_IMAGE_SIZE = (200, 300)
+
+# PNG bytes of a composited drop, keyed by the ordered tuple of card_ids
+drop_image_cache = LRUCache(DROP_IMAGE_CACHE_SIZE, DROP_IMAGE_CACHE_BYTES, len)
+# PNG bytes of a single card for !stats, keyed by card_id
+card_image_cache = LRUCache(CARD_IMAGE_CACHE_SIZE, CARD_IMAGE_CACHE_BYTES, len)
+
+
+class RenderQueueFull(Exception):
+    # Raised when RENDER_QUEUE_LIMIT renders are already pending
+    pass
+
+
+# Everything below down to RenderService runs inside the worker processes. Cards are passed as
+# "sources": their image file paths, which each worker decodes and keeps in a small LRU.
+
+def card_source(card):
+    return card.image_path
+
+
+def _open_source(source):
+    # The decoded image, or None if it can't be loaded. Keyed on the file's mtime as well as its
+    # path, so art replaced in place is picked up; failures aren't cached, so a missing file that
+    # turns up later is too.
+    try:
+        return _decode_image(source, os.stat(source).st_mtime_ns)
+    except Exception as e:
+        print(f"Error loading image: {e}")
+        return None
+
+
+@lru_cache(maxsize=WORKER_IMAGE_CACHE_SIZE)
+def _decode_image(path, mtime_ns):
+    image = Image.open(path)
+    if image.size != CARD_IMAGE_SIZE:
+        image = image.resize(CARD_IMAGE_SIZE)
+    image.load()
+    return image
+
+
+def encode_png(image):
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
+def compile_images(images): # Creates image of three cards, as PNG bytes
+    images = [image for image in images if image is not None]
+
+    if not images:
+        print("No images found for the selected cards.")
+        return None
+
+    total_width = sum(image.width for image in images)
+    max_height = max(image.height for image in images)
+
+    # Create a transparent background for the compiled image
+    compiled_image = Image.new("RGBA", (total_width, max_height), (0, 0, 0, 0))
+
+    x_offset = 0
+    for img in images:
+        compiled_image.paste(img, (x_offset, 0), img if img.mode == 'RGBA' else None)
+        x_offset += img.width
+
+    return encode_png(compiled_image)
+
+
+def render_drop_sources(sources):
+    # Returns (png, complete). A drop missing some of its images still renders, but shouldn't be cached.
+    images = [_open_source(source) for source in sources]
+    return compile_images(images), None not in images
+
+
+def render_card_source(source):
+    image = _open_source(source)
+    return encode_png(image) if image is not None else None
+
+
+class RenderService:
+    # Runs image rendering on a process (or thread) pool and awaits the result. Finished PNGs
+    # are cached, so only the first render of a drop or card reaches the pool.
+
+    def __init__(self, workers=RENDER_WORKERS, queue_limit=RENDER_QUEUE_LIMIT, use_processes=RENDER_USE_PROCESSES):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.use_processes = use_processes
+        self.depth = 0  # Renders currently queued or running
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _run(self, fn, arg):
+        if self.depth >= self.queue_limit:
+            raise RenderQueueFull()
+        self.depth += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, arg)
+        finally:
+            self.depth -= 1
+
+    async def drop_image(self, cards):
+        # Returns the PNG bytes of a card drop, or None if none of the cards have an image
+        key = tuple(card.card_id for card in cards)
+        png = drop_image_cache.get(key)
+        if png is None:
+            png, complete = await self._run(render_drop_sources, tuple(card_source(card) for card in cards))
+            if complete:
+                drop_image_cache.put(key, png)
+        return png
+
+    async def card_image(self, card):
+        # Returns the PNG bytes of a single card's image, or None if it has none
+        png = card_image_cache.get(card.card_id)
+        if png is None:
+            png = await self._run(render_card_source, card_source(card))
+            if png is not None:
+                card_image_cache.put(card.card_id, png)
+        return png
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+renderer = RenderService()
+
+
+def image_cache_stats():
+    # Hit/miss counters for both caches, for logging or an admin command
+    return {"drop": drop_image_cache.stats(), "card": card_image_cache.stats(), "render_queue": renderer.depth}
@@ -0,0 +1,128 @@
+# HOPS_interactions.py
+import asyncio
+from HOPS_expiry import expiry
+
+INTERACTION_TIMEOUT = 60.0  # Seconds a prompt waits for an answer unless told otherwise
+
+
+class InteractionManager:
+    # Routes reactions and replies to the coroutines waiting on them. bot.wait_for runs every
+    # pending check on every event, so each reaction got slower as more drops, trades and games
+    # were open. Here reaction waiters are kept per message_id and reply waiters per
+    # (channel_id, author_id), so an event is only looked at by waiters it could belong to.
+    #
+    # HOPS.on_reaction_add and HOPS.on_message feed events in through dispatch_reaction and
+    # dispatch_message. Both ignore the bot's own events before getting here. Timeouts are run by
+    # the shared expiry scheduler.
+
+    def __init__(self, default_timeout=INTERACTION_TIMEOUT):
+        self.default_timeout = default_timeout
+        self._reactions = {}  # message_id -> [_Waiter]
+        self._messages = {}  # (channel_id, author_id) -> [_Waiter]
+
+    async def wait_for_reaction(self, message, emojis, users=None, timeout=None, on_expire=None):
+        # Returns (reaction, user) for the next reaction on message with one of emojis, from one of
+        # users (anyone if None). Raises asyncio.TimeoutError if none arrives in time, after
+        # awaiting on_expire() (e.g. to mark the message as closed) if given.
+        emojis = set(emojis)
+        waiter = _Waiter(lambda reaction: str(reaction.emoji) in emojis, users)
+        return await self._wait(self._reactions, [message.id], waiter, timeout, on_expire)
+
+    async def wait_for_reactions(self, message, emojis, users, stop_emojis=(), timeout=None):
+        # Returns {user: emoji} once every one of users has reacted to message with one of emojis,
+        # or as soon as one of them picks an emoji in stop_emojis (e.g. a decline). Stays listening
+        # throughout, so players reacting at the same moment are all counted. Only each user's
+        # first reaction counts. Raises asyncio.TimeoutError if they don't all answer in time.
+        emojis, stop_emojis = set(emojis), set(stop_emojis)
+        waiter = _Waiter(lambda reaction: str(reaction.emoji) in emojis, users, collect=True,
+                         stop=lambda reaction: str(reaction.emoji) in stop_emojis)
+        collected = await self._wait(self._reactions, [message.id], waiter, timeout)
+        return {user: str(reaction.emoji) for user, (reaction, _) in collected.items()}
+
+    async def wait_for_message(self, channel, authors, prefix=None, timeout=None):
+        # Returns the next message in channel from one of authors, optionally only ones starting
+        # with prefix. Raises asyncio.TimeoutError if none arrives in time.
+        waiter = _Waiter(lambda message: prefix is None or message.content.startswith(prefix))
+        keys = [(channel.id, author.id) for author in authors]
+        return await self._wait(self._messages, keys, waiter, timeout)
+
+    async def wait_for_messages(self, channel, authors, prefix=None, timeout=None):
+        # Returns {author: message} once every one of authors has sent a message in channel
+        # (starting with prefix, if given), like wait_for_reactions. Raises asyncio.TimeoutError
+        # if they don't all answer in time.
+        waiter = _Waiter(lambda message: prefix is None or message.content.startswith(prefix), authors,
+                         collect=True)
+        keys = [(channel.id, author.id) for author in authors]
+        return await self._wait(self._messages, keys, waiter, timeout)
+
+    async def _wait(self, index, keys, waiter, timeout, on_expire=None):
+        for key in keys:
+            index.setdefault(key, []).append(waiter)
+        timeout = self.default_timeout if timeout is None else timeout
+        handle = expiry.schedule(timeout, self._expire, waiter.future, on_expire)
+        try:
+            return await waiter.future
+        finally:
+            expiry.cancel(handle)
+            for key in keys:
+                waiters = index[key]
+                waiters.remove(waiter)
+                if not waiters:
+                    del index[key]
+
+    @staticmethod
+    async def _expire(future, on_expire):
+        if future.done():
+            return
+        future.set_exception(asyncio.TimeoutError())
+        if on_expire is not None:
+            await on_expire()
+
+    def dispatch_reaction(self, reaction, user):
+        # Hands the reaction to the first waiter that wants it. Returns True if one did.
+        waiters = self._reactions.get(reaction.message.id)
+        if not waiters:
+            return False
+        return any(waiter.offer(user, reaction, (reaction, user)) for waiter in waiters)
+
+    def dispatch_message(self, message):
+        # Hands the message to the first waiter that wants it. Returns True if one did, in which
+        # case it is a reply to a prompt and should not be treated as a command.
+        waiters = self._messages.get((message.channel.id, message.author.id))
+        if not waiters:
+            return False
+        return any(waiter.offer(message.author, message, message) for waiter in waiters)
+
+    def stats(self):
+        return {"reaction_waiters": len(self._reactions), "message_waiters": len(self._messages)}
+
+
+class _Waiter:
+    # One pending wait. A plain waiter resolves with the first event it matches. A collector
+    # resolves with {user: result} once each of its users has answered, or when stop(event) is
+    # true, and stays registered until then.
+    __slots__ = ("future", "match", "user_ids", "collected", "stop")
+
+    def __init__(self, match, users=None, collect=False, stop=None):
+        self.future = asyncio.get_running_loop().create_future()
+        self.match = match
+        self.user_ids = None if users is None else {user.id for user in users}
+        self.collected = {} if collect else None
+        self.stop = stop
+
+    def offer(self, user, event, result):
+        # Takes event from user if it is wanted. Returns True if it was.
+        if self.future.done() or (self.user_ids is not None and user.id not in self.user_ids) or not self.match(event):
+            return False
+        if self.collected is None:
+            self.future.set_result(result)
+            return True
+        if user in self.collected:
+            return False
+        self.collected[user] = result
+        if len(self.collected) == len(self.user_ids) or (self.stop is not None and self.stop(event)):
+            self.future.set_result(self.collected)
+        return True
+
+
+interactions = InteractionManager()
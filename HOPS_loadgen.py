@@ -0,0 +1,450 @@
+# HOPS_loadgen.py
+import os, sys, json, time, random, asyncio, argparse, tempfile, contextlib
+import HOPS
+import commands
+from HOPS_db import db
+from HOPS_migrations import run_migrations
+from HOPS_interactions import interactions
+from HOPS_images import renderer, image_cache_stats
+from HOPS_fake_discord import FakeUser, FakeChannel, FakeReaction
+from HOPS_bench import BenchContext, use_placeholder_images, percentile, both, first_instance, format_image_cache_stats
+from player_cards import initialize_player_cards
+
+# Replays message and reaction streams into HOPS.on_message / HOPS.on_reaction_add against a
+# mocked gateway, to find how many messages per second the bot sustains before prompts start
+# timing out. Nothing connects to Discord. Run it against a database from `HOPS_bench.py generate`.
+#
+# Synthetic mode offers Poisson arrivals at each of --rates in turn, mixing chatter with commands.
+# Scripted users answer every prompt through the gateway after --think-time, the way a person
+# reacts once the buttons appear:
+#
+#   python HOPS_loadgen.py --db bench.db --rates 50 100 200 400 --duration 20
+#
+# Replay mode plays a recorded stream instead, one JSON event per line:
+#
+#   {"at": 0.5, "type": "message", "channel": "general", "author": 123, "content": "!cards"}
+#   {"at": 1.2, "type": "reaction", "channel": "general", "author": 123, "emoji": "1️⃣"}
+#
+# A reaction applies to the bot's latest message in that channel. "mentions" lists user IDs.
+#
+# Each stage reports event loop lag, gateway queue depth (events waiting for their handler to
+# start) and events in flight, and per command how many runs completed, timed out, hit a
+# cooldown, failed or were still going when the stage ended, followed by the image cache hit rates.
+
+LAG_SAMPLE_INTERVAL = 0.05  # Seconds between event loop lag samples
+BUTTON_WAIT = 5.0  # Longest a scripted user waits for a prompt's buttons to appear
+TIMEOUT_MARKERS = ("timed out", "expired", "did not respond in time", "took too long")
+RATE_LIMITED_MARKER = "Please wait"  # In both cooldown replies
+DEFAULT_MIX = {"chatter": 60, "cards": 15, "collection": 5, "view_team": 5, "stats": 5,
+               "odds": 3, "trade": 4, "challenge": 3}
+REPORT = sys.stdout  # Stage reports still print here while the bot's own output is silenced
+CHATTER = ("gg", "anyone up for a game?", "lol", "who has a spare Jordan", "brb", "nice pull!")
+STATS_PLAYERS = ("LeBron James", "Kevin Durant", "Stephen Curry", "Michael Jordan", "Kobe Bryant")
+
+
+class Gateway:
+    # Stands in for discord.py's gateway reader. Each event is handed to HOPS's handler on a task
+    # of its own, as discord.py does. With a concurrency limit, commands beyond it wait for a
+    # free slot; reactions and replies never wait, since the commands holding slots need them.
+
+    def __init__(self, concurrency=None):
+        self.slots = asyncio.Semaphore(concurrency) if concurrency else None
+        self.backlog = 0  # Events posted whose handler hasn't started yet
+        self.tasks = set()
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def post_message(self, message, is_command=False):
+        self.backlog += 1
+        return self._spawn(self._deliver_message(message, is_command))
+
+    def post_reaction(self, message, emoji, user):
+        self.backlog += 1
+        return self._spawn(self._deliver(HOPS.on_reaction_add(FakeReaction(message, emoji), user)))
+
+    async def _deliver(self, handler):
+        self.backlog -= 1
+        await handler
+
+    async def _deliver_message(self, message, is_command):
+        if self.slots is None or not is_command:
+            return await self._deliver(HOPS.on_message(message))
+        async with self.slots:
+            return await self._deliver(HOPS.on_message(message))
+
+
+class CommandStats:
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.latencies = []
+
+    def complete(self, started):
+        self.completed += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    def finish(self, channel, started):
+        # Classifies a run whose handler returned by the last thing the bot said in its channel
+        last = channel.last_message.content if channel.last_message is not None else ""
+        if any(marker in last for marker in TIMEOUT_MARKERS):
+            self.timed_out += 1
+        elif RATE_LIMITED_MARKER in last:
+            self.rate_limited += 1
+        else:
+            self.complete(started)
+
+    def report(self, pending):
+        latencies = sorted(self.latencies)
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "pending": pending,
+            "completion_rate": self.completed / self.started if self.started else 1.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+
+
+class LoadGenerator:
+    def __init__(self, ctx, gateway, think_time, seed):
+        self.ctx = ctx
+        self.gateway = gateway
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.stats = {}
+        self.pending = {}  # command -> sessions still running
+
+    async def press(self, message, emoji, user):
+        # Reacts once the button is on the message and the user has had time to read it
+        deadline = time.perf_counter() + BUTTON_WAIT
+        while emoji not in message.reactions and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(self.think_time)
+        self.gateway.post_reaction(message, emoji, user)
+
+    async def answer(self, channel, user, content):
+        await asyncio.sleep(self.think_time)
+        self.gateway.post_message(channel.message(user, content))
+
+    def channel(self, rules, done):
+        # rules are (text, action) pairs as in HOPS_bench; an action of None marks the command done
+        def respond(message):
+            if RATE_LIMITED_MARKER in message.content:
+                return  # Nothing to answer; the session sees it once the handler returns
+            for text, action in rules:
+                if (message.file is not None) if text is None else (text in message.content):
+                    if action is None:
+                        if not done.done():
+                            done.set_result(True)
+                    else:
+                        self.ctx.spawn(action(message))
+                    return
+        return FakeChannel(self.ctx.client.user, self.ctx.guild, responder=respond)
+
+    async def session(self, command):
+        # Sets up one command (untimed), posts it, and waits until it completes or the bot gives up
+        stats = self.stats.setdefault(command, CommandStats())
+        done = asyncio.get_running_loop().create_future()
+        content, author, mentions, channel = await getattr(self, f"_{command}")(done)
+        stats.started += 1
+        self.pending[command] = self.pending.get(command, 0) + 1
+        started = time.perf_counter()
+        try:
+            handler = self.gateway.post_message(channel.message(author, content, mentions), is_command=True)
+            await asyncio.wait({handler, done}, return_when=asyncio.FIRST_COMPLETED)
+            if done.done():
+                stats.complete(started)
+                return
+            await handler  # Raises if the handler failed
+            stats.finish(channel, started)
+        except Exception as e:
+            stats.errors += 1
+            print(f"  {command} failed: {e!r}", file=REPORT)
+        finally:
+            self.pending[command] -= 1
+
+    # Command scripts: each returns (content, author, mentions, channel)
+
+    async def _cards(self, done):
+        user = self.ctx.user()
+        channel = self.channel([(None, lambda message: self.press(message, "1️⃣", user)),
+                                ("You claimed", None)], done)
+        return "!cards", user, [], channel
+
+    async def _collection(self, done):
+        # Done once the first page shows, and a page flip if there is more than one
+        user = self.ctx.user()
+
+        async def flip(message):
+            if "Page 1/1:" in message.content or "Page" not in message.content:
+                done.done() or done.set_result(True)
+                return
+            await self.press(message, "▶️", user)
+            await message.edited.wait()
+            done.done() or done.set_result(True)
+
+        return "!collection", user, [], self.channel([("", flip)], done)
+
+    async def _view_team(self, done):
+        return "!view_team", self.ctx.user(with_team=True), [], self.channel([], done)
+
+    async def _stats(self, done):
+        return f"!stats {self.rng.choice(STATS_PLAYERS)}", self.ctx.user(), [], self.channel([], done)
+
+    async def _odds(self, done):
+        user, target = self.ctx.user_pair(with_team=True)
+        return f"!odds {target.mention}", user, [target], self.channel([], done)
+
+    async def _trade(self, done):
+        sender, target = self.ctx.user_pair()
+        sender_card = await db.read(first_instance, sender.id)
+        target_card = await db.read(first_instance, target.id)
+        channel = self.channel([
+            ("Do you accept or decline?", lambda message: self.press(message, "✅", target)),
+            ("input your return offer", lambda message: self.answer(channel, target, f"!return {target_card}")),
+            ("Do both players accept?", lambda message: both(
+                self.press(message, "✅", sender), self.press(message, "✅", target))),
+            ("Trade Completed", None),
+        ], done)
+        return f"!trade {target.mention} {sender_card}", sender, [target], channel
+
+    async def _challenge(self, done):
+        challenger, target = self.ctx.user_pair(with_team=True)
+
+        def both_press(message):
+            return both(self.press(message, "✅", challenger), self.press(message, "✅", target))
+
+        def both_wager(message):
+            return both(self.answer(channel, challenger, "!wager $10"), self.answer(channel, target, "!wager $10"))
+
+        def play(message):
+            return self.press(message, "1️⃣", target if target.mention in message.content else challenger)
+
+        channel = self.channel([
+            ("has challenged you", lambda message: self.press(message, "✅", target)),
+            ("would you like to make a wager", both_press),
+            ("To make an offer", both_wager),
+            ("Do both players accept these terms", both_press),
+            ("Middle of Q", play),
+            ("Game Over", None),
+        ], done)
+        return f"!challenge {target.mention}", challenger, [target], channel
+
+    def chatter(self):
+        user = self.ctx.user()
+        channel = FakeChannel(self.ctx.client.user, self.ctx.guild)
+        self.gateway.post_message(channel.message(user, self.rng.choice(CHATTER)))
+
+
+async def monitor(gateway, samples, stop):
+    # Samples how late the event loop wakes up, and the gateway queue at the same moment
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_SAMPLE_INTERVAL
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        samples.append((max(0.0, loop.time() - expected), gateway.backlog, len(gateway.tasks)))
+
+
+def stage_report(rate, elapsed, events, samples, generator):
+    lags = sorted(lag for lag, _, _ in samples)
+    depths = [depth for _, depth, _ in samples]
+    in_flight = [events for _, _, events in samples]
+    return {
+        "offered_rate": rate,
+        "achieved_rate": events / elapsed if elapsed else 0.0,
+        "loop_lag_p50_ms": percentile(lags, 0.50) * 1000,
+        "loop_lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "loop_lag_max_ms": (lags[-1] if lags else 0.0) * 1000,
+        "queue_depth_mean": sum(depths) / len(depths) if depths else 0.0,
+        "queue_depth_max": max(depths, default=0),
+        "in_flight_mean": sum(in_flight) / len(in_flight) if in_flight else 0.0,
+        "in_flight_max": max(in_flight, default=0),
+        "commands": {command: stats.report(generator.pending.get(command, 0))
+                     for command, stats in sorted(generator.stats.items())},
+        "image_caches": image_cache_stats(),  # Counted since the run started, not per stage
+    }
+
+
+async def run_synthetic(ctx, gateway, rates, duration, drain, mix, think_time, seed):
+    reports = []
+    kinds, weights = zip(*mix.items())
+    for stage, rate in enumerate(rates):
+        generator = LoadGenerator(ctx, gateway, think_time, seed + stage)
+        samples, stop = [], asyncio.Event()
+        sampler = asyncio.create_task(monitor(gateway, samples, stop))
+        sessions = set()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_event = started
+        events = 0
+        while next_event < started + duration:
+            await asyncio.sleep(max(0.0, next_event - loop.time()))
+            kind = generator.rng.choices(kinds, weights)[0]
+            if kind == "chatter":
+                generator.chatter()
+            else:
+                session = asyncio.create_task(generator.session(kind))
+                sessions.add(session)
+                session.add_done_callback(sessions.discard)
+            events += 1
+            next_event += generator.rng.expovariate(rate)
+        elapsed = loop.time() - started
+        # Let commands still in flight finish or time out, so they don't spill into the next stage
+        if sessions:
+            await asyncio.wait(set(sessions), timeout=drain)
+        stop.set()
+        await sampler
+        reports.append(stage_report(rate, elapsed, events, samples, generator))
+        print_stage(reports[-1])
+        for session in list(sessions):
+            session.cancel()
+    return reports
+
+
+async def run_replay(ctx, gateway, path, speed):
+    # Plays a recorded stream. Commands are timed from post to handler return, and judged by the
+    # bot's last message in their channel, so busy shared channels can blur the timeout counts.
+    generator = LoadGenerator(ctx, gateway, 0, 0)
+    channels = {}
+    users = {}
+    samples, stop = [], asyncio.Event()
+    sampler = asyncio.create_task(monitor(gateway, samples, stop))
+    handlers = []
+
+    def user(user_id):
+        if user_id not in users:
+            users[user_id] = ctx.guild.members[user_id] = FakeUser(user_id)
+        return users[user_id]
+
+    async def timed(command, handler, channel):
+        stats = generator.stats.setdefault(command, CommandStats())
+        stats.started += 1
+        started = time.perf_counter()
+        try:
+            await handler
+        except Exception as e:
+            stats.errors += 1
+            print(f"  {command} failed: {e!r}", file=REPORT)
+            return
+        stats.finish(channel, started)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    events = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            await asyncio.sleep(max(0.0, started + event["at"] / speed - loop.time()))
+            channel = channels.setdefault(event["channel"], FakeChannel(ctx.client.user, ctx.guild, name=event["channel"]))
+            author = user(event["author"])
+            if event["type"] == "reaction":
+                if channel.last_message is not None:
+                    gateway.post_reaction(channel.last_message, event["emoji"], author)
+            else:
+                message = channel.message(author, event["content"], [user(m) for m in event.get("mentions", ())])
+                matched = HOPS.router.match(message.content)
+                handler = gateway.post_message(message, is_command=matched is not None)
+                if matched is not None:
+                    handlers.append(asyncio.create_task(timed(matched[0].name.lstrip('!'), handler, channel)))
+            events += 1
+
+    elapsed = loop.time() - started
+    await asyncio.gather(*handlers)
+    stop.set()
+    await sampler
+    report = stage_report(events / elapsed if elapsed else 0.0, elapsed, events, samples, generator)
+    print_stage(report)
+    return [report]
+
+
+def print_stage(report):
+    print(file=REPORT)
+    print(f"{report['offered_rate']:8.1f} ev/s offered, {report['achieved_rate']:8.1f} achieved | "
+          f"loop lag p50 {report['loop_lag_p50_ms']:.1f} ms p99 {report['loop_lag_p99_ms']:.1f} ms "
+          f"max {report['loop_lag_max_ms']:.1f} ms | queue mean {report['queue_depth_mean']:.1f} max {report['queue_depth_max']} | "
+          f"in flight mean {report['in_flight_mean']:.1f} max {report['in_flight_max']}", file=REPORT)
+    for command, stats in report["commands"].items():
+        print(f"    {command:<12} {stats['completed']:>6}/{stats['started']:<6} done ({stats['completion_rate']:.1%})  "
+              f"timed out {stats['timed_out']:<5} limited {stats['rate_limited']:<5} errors {stats['errors']:<4} pending {stats['pending']:<5} "
+              f"p50 {stats['p50_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms", file=REPORT)
+    print(f"    {format_image_cache_stats(report['image_caches'])}", file=REPORT)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown event kind {kind!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive HOPS.on_message with synthetic or recorded gateway traffic.")
+    parser.add_argument('--db', default='HOPS_bench.db', help="Database from `HOPS_bench.py generate`")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rates', type=float, nargs='+', default=[50, 100, 200], help="Events per second, one stage each")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per stage")
+    parser.add_argument('--drain', type=float, default=30, help="Seconds to let commands finish after each stage")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="Event weights, e.g. chatter=60,cards=15,trade=4")
+    parser.add_argument('--concurrency', type=int, default=None, help="Commands handled at once (default: unlimited)")
+    parser.add_argument('--think-time', type=float, default=0.2, help="Seconds a scripted user takes to answer a prompt")
+    parser.add_argument('--prompt-timeout', type=float, default=10, help="Seconds prompts and drops wait for an answer")
+    parser.add_argument('--replay', help="Replay this JSON lines stream instead of synthetic traffic")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument('--json', help="Write the stage reports here")
+    parser.add_argument('--verbose', action='store_true', help="Show the bot's own output")
+    options = parser.parse_args()
+
+    db.path = options.db
+    initialize_player_cards()
+    run_migrations()
+    interactions.default_timeout = options.prompt_timeout
+    commands.DROP_LIFETIME = options.prompt_timeout
+
+    async def run():
+        ctx = BenchContext(options.seed)
+        gateway = Gateway(options.concurrency)
+        random.seed(options.seed)
+        try:
+            if options.replay:
+                return await run_replay(ctx, gateway, options.replay, options.speed)
+            return await run_synthetic(ctx, gateway, options.rates, options.duration, options.drain, options.mix,
+                                       options.think_time, options.seed)
+        finally:
+            for task in list(gateway.tasks) + list(ctx.tasks):
+                task.cancel()
+
+    with tempfile.TemporaryDirectory() as images:
+        use_placeholder_images(images)
+        try:
+            with contextlib.ExitStack() as quiet:
+                if not options.verbose:
+                    quiet.enter_context(contextlib.redirect_stdout(quiet.enter_context(open(os.devnull, 'w'))))
+                reports = asyncio.run(run())
+        finally:
+            renderer.shutdown()
+            db.close()
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
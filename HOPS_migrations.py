@@ -0,0 +1,233 @@
+# HOPS_migrations.py
+from HOPS_db import db
+from player_cards import normalize_name
+
+# Each migration runs once, in order, inside its own transaction. The number of the last applied
+# migration is stored in the database's PRAGMA user_version. Append new migrations to the end of
+# MIGRATIONS; never edit or reorder one that has shipped.
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _has_index_on(conn, table, column):
+    # True if an index (including the one SQLite makes for a UNIQUE constraint) starts with column
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        index_columns = conn.execute(f"PRAGMA index_info({index[1]})").fetchall()
+        if index_columns and index_columns[0][2] == column:
+            return True
+    return False
+
+
+def _create_base_tables(conn):
+    # The tables the bot used to create on demand (users, teams, cards), plus user_cards, which
+    # had no declared schema. IF NOT EXISTS keeps databases that already have them intact.
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        discord_id TEXT UNIQUE,
+        court_cash INTEGER DEFAULT 0
+    )''')
+    if 'court_cash' not in _columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN court_cash INTEGER DEFAULT 0')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cards (
+            card_id INTEGER PRIMARY KEY,
+            player_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            season_year INTEGER NOT NULL,
+            stats TEXT NOT NULL,
+            offensive_rating REAL NOT NULL,
+            defensive_rating REAL NOT NULL,
+            attributes TEXT NOT NULL  -- New attribute for storing player-specific attributes
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_cards (
+            instance_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            instance_number INTEGER NOT NULL,
+            condition TEXT,
+            offensive_rating REAL,
+            defensive_rating REAL,
+            attributes TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (card_id) REFERENCES cards (card_id)
+        )
+    ''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS teams (
+        user_id INTEGER PRIMARY KEY,
+        team_name TEXT,
+        point_guard TEXT,
+        shooting_guard TEXT,
+        small_forward TEXT,
+        power_forward TEXT,
+        center TEXT,
+        sixth_man TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )''')
+
+
+def _add_hot_query_indexes(conn):
+    # Collections, lineups and trades look cards up by owner and by instance ID,
+    # and claims look up the highest serial of a card.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_cards_user_id ON user_cards (user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_cards_card_serial ON user_cards (card_id, instance_number)')
+    if not _has_index_on(conn, 'user_cards', 'instance_id'):
+        conn.execute('CREATE UNIQUE INDEX idx_user_cards_instance_id ON user_cards (instance_id)')
+    # users.discord_id is normally covered by its UNIQUE constraint already
+    if not _has_index_on(conn, 'users', 'discord_id'):
+        conn.execute('CREATE UNIQUE INDEX idx_users_discord_id ON users (discord_id)')
+
+
+def _add_card_name_key(conn):
+    # LOWER(player_name) can't use an index, and SQLite can't strip accents. Store the
+    # normalize_name() key of each card instead, and look cards up by it.
+    if 'name_key' not in _columns(conn, 'cards'):
+        conn.execute('ALTER TABLE cards ADD COLUMN name_key TEXT')
+    rows = conn.execute('SELECT card_id, player_name FROM cards').fetchall()
+    conn.executemany('UPDATE cards SET name_key = ? WHERE card_id = ?',
+                     [(normalize_name(player_name), card_id) for card_id, player_name in rows])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cards_name_key ON cards (name_key, season_year)')
+
+
+def _add_card_serials(conn):
+    # One counter row per card hands out instance numbers, instead of scanning
+    # MAX(instance_number) on every claim. Seeded from the serials already issued.
+    conn.execute('''CREATE TABLE IF NOT EXISTS card_serials (
+        card_id INTEGER PRIMARY KEY,
+        last_serial INTEGER NOT NULL
+    )''')
+    conn.execute('''
+        INSERT OR REPLACE INTO card_serials (card_id, last_serial)
+        SELECT card_id, MAX(instance_number) FROM user_cards GROUP BY card_id
+    ''')
+
+
+def _add_id_sequences(conn):
+    # Named counters for generated IDs. Instance IDs are the base62 encoding of the
+    # 'instance_id' sequence instead of random strings that can collide.
+    conn.execute('''CREATE TABLE IF NOT EXISTS id_sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )''')
+
+
+def _add_card_content_hash(conn):
+    # Lets the startup sync skip cards that have not changed since the last boot
+    if 'content_hash' not in _columns(conn, 'cards'):
+        conn.execute('ALTER TABLE cards ADD COLUMN content_hash TEXT')
+
+
+def _add_rate_limits(conn):
+    # Saved token buckets for rate limits that must survive a restart, like the drop cooldown
+    conn.execute('''CREATE TABLE IF NOT EXISTS rate_limits (
+        discord_id TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (discord_id, bucket)
+    )''')
+
+
+def _add_collection_sort_indexes(conn):
+    # Keyset pagination for !collection: one index per sort order. "recent" uses
+    # idx_user_cards_user_id, which already ends in the rowid.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_cards_user_serial ON user_cards (user_id, instance_number)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_cards_user_card ON user_cards (user_id, card_id, instance_number)')
+
+
+def _add_user_card_counts(conn):
+    # Copies owned per user, card and condition, for !collection summary and collection sizes.
+    # Kept up to date by commands.count_cards wherever user_cards rows are added or change owner.
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_card_counts (
+        user_id INTEGER NOT NULL,
+        card_id INTEGER NOT NULL,
+        condition TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, card_id, condition)
+    ) WITHOUT ROWID''')
+    conn.execute('DELETE FROM user_card_counts')
+    conn.execute('''
+        INSERT INTO user_card_counts (user_id, card_id, condition, count)
+        SELECT user_id, card_id, COALESCE(condition, 'Unknown'), COUNT(*)
+        FROM user_cards GROUP BY user_id, card_id, COALESCE(condition, 'Unknown')
+    ''')
+
+
+def _add_standings(conn):
+    # Results of HOPS_tournament round robins, one standings row per team per tournament
+    conn.execute('''CREATE TABLE IF NOT EXISTS tournaments (
+        tournament_id INTEGER PRIMARY KEY,
+        started REAL NOT NULL,
+        seed TEXT NOT NULL,
+        teams INTEGER NOT NULL,
+        games INTEGER NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS standings (
+        tournament_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        team_name TEXT,
+        wins INTEGER NOT NULL,
+        losses INTEGER NOT NULL,
+        points_for REAL NOT NULL,
+        points_against REAL NOT NULL,
+        PRIMARY KEY (tournament_id, rank),
+        FOREIGN KEY (tournament_id) REFERENCES tournaments (tournament_id)
+    )''')
+
+
+def _add_team_totals(conn):
+    # Offensive and defensive totals of each lineup, kept up to date by
+    # commands.refresh_team_ratings so games and tournaments don't re-sum the roster
+    if 'offensive_total' not in _columns(conn, 'teams'):
+        conn.execute('ALTER TABLE teams ADD COLUMN offensive_total REAL NOT NULL DEFAULT 0')
+    if 'defensive_total' not in _columns(conn, 'teams'):
+        conn.execute('ALTER TABLE teams ADD COLUMN defensive_total REAL NOT NULL DEFAULT 0')
+    conn.execute('''
+        UPDATE teams SET (offensive_total, defensive_total) = (
+            SELECT COALESCE(SUM(cards.offensive_rating), 0), COALESCE(SUM(cards.defensive_rating), 0)
+            FROM (SELECT teams.point_guard AS instance_id UNION ALL SELECT teams.shooting_guard
+                  UNION ALL SELECT teams.small_forward UNION ALL SELECT teams.power_forward
+                  UNION ALL SELECT teams.center UNION ALL SELECT teams.sixth_man) AS lineup
+            JOIN user_cards ON user_cards.instance_id = lineup.instance_id AND user_cards.user_id = teams.user_id
+            JOIN cards ON cards.card_id = user_cards.card_id
+        )
+    ''')
+
+
+MIGRATIONS = [
+    (1, "Create base tables", _create_base_tables),
+    (2, "Index user_cards and users for the hot queries", _add_hot_query_indexes),
+    (3, "Add normalized card name key", _add_card_name_key),
+    (4, "Add per-card serial counters", _add_card_serials),
+    (5, "Add ID sequences", _add_id_sequences),
+    (6, "Add card content hashes", _add_card_content_hash),
+    (7, "Add saved rate limits", _add_rate_limits),
+    (8, "Index user_cards for collection sorting", _add_collection_sort_indexes),
+    (9, "Add per-user card counts", _add_user_card_counts),
+    (10, "Add tournament standings", _add_standings),
+    (11, "Store team rating totals", _add_team_totals),
+]
+
+
+def run_migrations():
+    # Brings the database schema up to date. Called once at startup, before the bot connects.
+    with db.writer() as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with db.writer() as conn:
+            conn.execute('BEGIN')
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+        print(f"Applied migration {number}: {description}")
+
+    return max(version, MIGRATIONS[-1][0])
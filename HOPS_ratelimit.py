@@ -0,0 +1,100 @@
+# HOPS_ratelimit.py
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from HOPS_db import db
+
+RATE_LIMIT_MAX_ENTRIES = 100000  # Buckets kept in memory before the least recently used are dropped
+
+
+class RateLimit(NamedTuple):
+    capacity: float  # Uses allowed back to back
+    period: float  # Seconds to earn back one use. 0 disables the limit.
+    persist: bool = False  # Save the bucket to the database so it survives a restart
+
+
+class RateLimiter:
+    # Token buckets per (limit name, discord_id). Each bucket holds up to `capacity` tokens,
+    # regains one every `period` seconds, and every use takes one.
+    #
+    # A bucket that has refilled is the same as no bucket at all, so it is evicted, and only
+    # users who have used a command recently take up memory. If more than max_entries buckets
+    # are still refilling, the least recently used ones are dropped early, which only ever
+    # errs in the user's favour. Persisted buckets are reloaded from the database when needed,
+    # so evicting them loses nothing.
+    #
+    # Buckets use wall-clock time so that saved ones still make sense after a restart.
+
+    def __init__(self, limits, max_entries=RATE_LIMIT_MAX_ENTRIES):
+        self.limits = dict(limits)
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # (name, discord_id) -> (tokens, updated), least recently used first
+
+    def _tokens(self, limit, state, now):
+        if state is None:
+            return limit.capacity
+        tokens, updated = state
+        return min(limit.capacity, tokens + (now - updated) / limit.period)
+
+    def _is_full(self, name, state, now):
+        limit = self.limits[name]
+        return self._tokens(limit, state, now) >= limit.capacity
+
+    def _store(self, key, state):
+        self._buckets[key] = state
+        self._buckets.move_to_end(key)
+        now = state[1]
+        while self._buckets:
+            oldest, oldest_state = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_entries and not self._is_full(oldest[0], oldest_state, now):
+                break
+            self._buckets.popitem(last=False)
+
+    async def acquire(self, name, discord_id):
+        # Takes one use from discord_id's bucket for `name`. Returns 0 if the command may go
+        # ahead, otherwise the number of seconds until the next use is available.
+        limit = self.limits[name]
+        if limit.period <= 0:
+            return 0
+        key = (name, discord_id)
+        state = self._buckets.get(key)
+        if state is None and limit.persist:
+            saved = await db.read(_load_bucket, name, str(discord_id))
+            state = self._buckets.get(key, saved)  # Another message may have filled it in meanwhile
+
+        now = time.time()
+        tokens = self._tokens(limit, state, now)
+        if tokens < 1:
+            self._store(key, (tokens, now))
+            return (1 - tokens) * limit.period
+
+        tokens -= 1
+        self._store(key, (tokens, now))
+        if limit.persist:
+            await db.write(_save_bucket, name, str(discord_id), tokens, now)
+        return 0
+
+    def prune_saved(self):
+        # Deletes saved buckets that have refilled since they were written. Called at startup.
+        now = time.time()
+        with db.writer() as conn:
+            for name, limit in self.limits.items():
+                if limit.persist and limit.period > 0:
+                    conn.execute('DELETE FROM rate_limits WHERE bucket = ? AND updated <= ? - (? - tokens) * ?',
+                                 (name, now, limit.capacity, limit.period))
+
+    def stats(self):
+        return {"buckets": len(self._buckets), "max_entries": self.max_entries}
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _load_bucket(conn, name, discord_id):
+    return conn.execute('SELECT tokens, updated FROM rate_limits WHERE discord_id = ? AND bucket = ?',
+                        (discord_id, name)).fetchone()
+
+
+def _save_bucket(conn, name, discord_id, tokens, updated):
+    conn.execute('INSERT OR REPLACE INTO rate_limits (discord_id, bucket, tokens, updated) VALUES (?, ?, ?, ?)',
+                 (discord_id, name, tokens, updated))
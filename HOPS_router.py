@@ -0,0 +1,48 @@
+# HOPS_router.py
+from typing import NamedTuple
+
+COMMAND_PREFIX = '!'
+
+
+class Command(NamedTuple):
+    name: str
+    handler: object  # async handler(message, args)
+    usage: str = None
+    min_args: int = 0
+
+
+class CommandRouter:
+    # Maps command names ("!cards") to their handlers. A message is checked for the prefix and
+    # then its first word is looked up in a dict, so ordinary chat returns straight away and
+    # adding commands does not make dispatch any slower.
+
+    def __init__(self, prefix=COMMAND_PREFIX):
+        self.prefix = prefix
+        self.commands = {}
+
+    def command(self, name, usage=None, min_args=0):
+        # Decorator that registers handler(message, args) for name. args is the list of words
+        # after the command; with fewer than min_args of them the usage text is sent instead.
+        def register(handler):
+            if name in self.commands:
+                raise ValueError(f"Command {name} is already registered")
+            self.commands[name] = Command(name, handler, usage, min_args)
+            return handler
+        return register
+
+    def match(self, content):
+        # Returns (command, args) if content invokes a registered command, else None
+        if not content.startswith(self.prefix):
+            return None
+        parts = content.split(None, 1)
+        command = self.commands.get(parts[0])
+        if command is None:
+            return None
+        args = parts[1].split() if len(parts) > 1 else []
+        return command, args
+
+    async def dispatch(self, message, command, args):
+        if len(args) < command.min_args:
+            await message.channel.send(command.usage)
+            return
+        await command.handler(message, args)
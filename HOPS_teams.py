@@ -1,94 +1,144 @@
 # HOPS_teams.py
-import sqlite3, asyncio
-from commands import get_user_id, connect_db, user_owns_card
-
-def create_user_team(discord_id, team_name, instance_ids):
+import asyncio
+from typing import NamedTuple
+from commands import get_user_id, refresh_team_ratings
+from HOPS_db import db
+from HOPS_cache import invalidate_team, team_text_cache
+from HOPS_interactions import interactions
+
+# Team columns in lineup order
+TEAM_POSITIONS = ("point_guard", "shooting_guard", "small_forward", "power_forward", "center", "sixth_man")
+
+
+class RosterPlayer(NamedTuple):
+    # One filled slot of a team's lineup
+    slot: str  # Team position column, e.g. "point_guard"
+    instance_id: str
+    instance_number: int
+    card_id: int
+    player_name: str
+    position: str  # The positions the player can play, from the cards table
+    offensive_rating: float
+    defensive_rating: float
+    attributes: str
+
+
+class TeamData(NamedTuple):
+    # A team as games see it: the filled slots, and the rating totals stored on the teams table
+    # (kept equal to the sum of those players' ratings by refresh_team_ratings)
+    players: tuple  # RosterPlayer per filled slot
+    offensive_total: float
+    defensive_total: float
+
+
+def fetch_lineup(conn, discord_id):
+    # Loads a user's whole team with one join over users/teams/user_cards/cards.
+    # Returns (user_id, team_name, slots, totals) where slots is a list of (position, RosterPlayer or None)
+    # in TEAM_POSITIONS order and totals is the team's stored (offensive_total, defensive_total).
+    # user_id is None for unregistered users; team_name, slots and totals are None if they have no team.
+    # A card only fills a slot while the team owner still owns it, so traded-away cards drop out.
+    rows = conn.execute('''
+        SELECT u.user_id, t.user_id, t.team_name,
+               t.point_guard, t.shooting_guard, t.small_forward, t.power_forward, t.center, t.sixth_man,
+               t.offensive_total, t.defensive_total,
+               uc.instance_id, uc.instance_number, c.card_id, c.player_name, c.position,
+               c.offensive_rating, c.defensive_rating, c.attributes
+        FROM users u
+        LEFT JOIN teams t ON t.user_id = u.user_id
+        LEFT JOIN user_cards uc ON uc.user_id = t.user_id
+            AND uc.instance_id IN (t.point_guard, t.shooting_guard, t.small_forward,
+                                   t.power_forward, t.center, t.sixth_man)
+        LEFT JOIN cards c ON c.card_id = uc.card_id
+        WHERE u.discord_id = ?
+    ''', (discord_id,)).fetchall()
+
+    if not rows:
+        return None, None, None, None
+    user_id, team_user_id, team_name = rows[0][:3]
+    if team_user_id is None:
+        return user_id, None, None, None
+
+    cards = {row[11]: row[11:] for row in rows if row[11] is not None and row[13] is not None}
+    slots = []
+    for position, instance_id in zip(TEAM_POSITIONS, rows[0][3:9]):
+        card = cards.get(instance_id)
+        slots.append((position, RosterPlayer(position, *card) if card else None))
+    return user_id, team_name, slots, rows[0][9:11]
+
+
+async def create_user_team(discord_id, team_name, instance_ids):
     # Adds user to teams table and makes a six-man team of players
     if len(instance_ids) != 6:
         return "You must provide exactly six instance IDs, one for each position."
 
-    user_id = get_user_id(discord_id)
+    user_id = await get_user_id(discord_id)
     if user_id is None:
         return "User not found. Use `!cards` first to add yourself to the database."
 
-    with connect_db() as conn:
-        c = conn.cursor()
-
-        # Ensure the teams table exists
-        c.execute('''CREATE TABLE IF NOT EXISTS teams (
-            user_id INTEGER PRIMARY KEY,
-            team_name TEXT,
-            point_guard TEXT,
-            shooting_guard TEXT,
-            small_forward TEXT,
-            power_forward TEXT,
-            center TEXT,
-            sixth_man TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )''')
-
-        # Check if the user already has a team
-        c.execute('SELECT team_name FROM teams WHERE user_id = ?', (user_id,))
-        existing_team = c.fetchone()
-        if existing_team:
-            return f"You already have a team named '{existing_team[0]}'. Use `!rename_team` to make changes to it."
-
-        # Validate instance IDs and ensure no duplicate card_id is used
-        c.execute('SELECT card_id, instance_id FROM user_cards WHERE user_id = ? AND instance_id IN (?, ?, ?, ?, ?, ?)',
-                  (user_id, *instance_ids))
-        owned_cards = c.fetchall()
-
-        if len(owned_cards) != 6:
-            return "One or more instance IDs are invalid or do not belong to you."
-
-        card_ids = [card[0] for card in owned_cards]
-        if len(set(card_ids)) != 6:
-            return "You cannot use the same player in multiple positions."
-
-        # Insert the new team
-        c.execute('''
-            INSERT INTO teams (user_id, team_name, point_guard, shooting_guard, small_forward, power_forward, center, sixth_man) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, team_name, *instance_ids))
-        conn.commit()
+    response = await db.write(_create_user_team, user_id, team_name, instance_ids)
+    invalidate_team(discord_id)
+    return response
+
+
+def _create_user_team(conn, user_id, team_name, instance_ids):
+    c = conn.cursor()
+
+    # Check if the user already has a team
+    c.execute('SELECT team_name FROM teams WHERE user_id = ?', (user_id,))
+    existing_team = c.fetchone()
+    if existing_team:
+        return f"You already have a team named '{existing_team[0]}'. Use `!rename_team` to make changes to it."
+
+    # Validate instance IDs and ensure no duplicate card_id is used
+    c.execute('SELECT card_id, instance_id FROM user_cards WHERE user_id = ? AND instance_id IN (?, ?, ?, ?, ?, ?)',
+              (user_id, *instance_ids))
+    owned_cards = c.fetchall()
+
+    if len(owned_cards) != 6:
+        return "One or more instance IDs are invalid or do not belong to you."
+
+    card_ids = [card[0] for card in owned_cards]
+    if len(set(card_ids)) != 6:
+        return "You cannot use the same player in multiple positions."
+
+    # Insert the new team
+    c.execute('''
+        INSERT INTO teams (user_id, team_name, point_guard, shooting_guard, small_forward, power_forward, center, sixth_man) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, team_name, *instance_ids))
+    refresh_team_ratings(c, (user_id,))
 
     return f"Team '{team_name}' created successfully!"
 
-def change_team_name(discord_id, new_team_name):
-    user_id = get_user_id(discord_id)
+async def change_team_name(discord_id, new_team_name):
+    user_id = await get_user_id(discord_id)
     if user_id is None:
         return "User not found. Use `!cards` first to add yourself to the database."
 
-    with connect_db() as conn:
-        c = conn.cursor()
-        c.execute('UPDATE teams SET team_name = ? WHERE user_id = ?', (new_team_name, user_id))
-        conn.commit()
+    await db.write(_rename_team, user_id, new_team_name)
+    invalidate_team(discord_id)
 
     return f"Team name updated to '{new_team_name}'!"
 
 
+def _rename_team(conn, user_id, new_team_name):
+    conn.execute('UPDATE teams SET team_name = ? WHERE user_id = ?', (new_team_name, user_id))
+
+
 async def update_team_position(message, user_id, bot):
     # Updates individual position on user's team
     sender = message.author
     sender_id = sender.id
 
-    with connect_db() as conn:
-        c = conn.cursor()
-
-        # Get user ID
-        c.execute("SELECT user_id FROM users WHERE discord_id = ?", (sender_id,))
-        user_row = c.fetchone()
-        if not user_row:
-            await message.channel.send("You need to be registered first. Use `!cards` to register.")
-            return
-        user_id = user_row[0]
+    user_id, team_row = await db.read(_fetch_user_team_name, sender_id)
+    if user_id is None:
+        await message.channel.send("You need to be registered first. Use `!cards` to register.")
+        return
 
-        # Check if user has a team
-        c.execute("SELECT team_name FROM teams WHERE user_id = ?", (user_id,))
-        team_row = c.fetchone()
-        if not team_row:
-            await message.channel.send("You don't have a team yet! Use `!team <team_name>` first.")
-            return
+    # Check if user has a team
+    if not team_row:
+        await message.channel.send("You don't have a team yet! Use `!team <team_name>` first.")
+        return
 
     # Ask which position they want to update
     position_msg = await message.channel.send(
@@ -97,11 +147,8 @@ async def update_team_position(message, user_id, bot):
     for emoji in reactions:
         await position_msg.add_reaction(emoji)
 
-    def check_reaction(reaction, user):
-        return user == sender and reaction.message.id == position_msg.id and str(reaction.emoji) in reactions
-
     try:
-        reaction, _ = await bot.wait_for("reaction_add", timeout=60.0, check=check_reaction)
+        reaction, _ = await interactions.wait_for_reaction(position_msg, reactions, [sender])
     except asyncio.TimeoutError:
         await message.channel.send("Team update timed out.")
         return
@@ -119,77 +166,84 @@ async def update_team_position(message, user_id, bot):
     await message.channel.send(
         f"Send the instance ID of the player you want to assign as your {selected_position.replace('_', ' ').title()}.")
 
-    def check_message(m):
-        return m.author == sender and m.channel == message.channel
-
     try:
-        instance_msg = await bot.wait_for("message", timeout=60.0, check=check_message)
+        instance_msg = await interactions.wait_for_message(message.channel, [sender])
     except asyncio.TimeoutError:
         await message.channel.send("You took too long to respond.")
         return
 
     instance_id = instance_msg.content.strip()
 
-    with connect_db() as conn:
-        c = conn.cursor()
-        # Validate that the user owns the card
-        c.execute("SELECT card_id FROM user_cards WHERE instance_id = ? AND user_id = ?", (instance_id, user_id))
-        card_row = c.fetchone()
-        if not card_row:
-            await message.channel.send("You do not own this card or the instance ID is incorrect.")
-            return
-        card_id = card_row[0]
-
-        # Update the team
-        c.execute(f"UPDATE teams SET {selected_position} = ? WHERE user_id = ?", (instance_id, user_id))
-        conn.commit()
+    if not await db.write(_set_team_position, user_id, selected_position, instance_id):
+        await message.channel.send("You do not own this card or the instance ID is incorrect.")
+        return
+    invalidate_team(sender_id)
 
     await message.channel.send(f"Your {selected_position.replace('_', ' ').title()} has been updated!")
 
-def view_team(discord_id):
-    # Sends message with users' team
-    user_id = get_user_id(discord_id)
-    if user_id is None:
-        return "User not found. Use `!cards` first to add yourself to the database."
 
-    with connect_db() as conn:
-        c = conn.cursor()
-
-        # Retrieve the team information
-        c.execute(
-            'SELECT team_name, point_guard, shooting_guard, small_forward, power_forward, center, sixth_man FROM teams WHERE user_id = ?',
-            (user_id,))
-        team = c.fetchone()
-
-        if team is None:
-            return "You do not have a team yet. Use `!team create <team_name>` to create one."
-
-        team_name, pg, sg, sf, pf, c_, sm = team
-
-        # Retrieve player names based on instance IDs
-        def get_player(instance_id):
-            if instance_id:
-                with connect_db() as conn:
-                    c = conn.cursor()
-                    c.execute('''
-                        SELECT c.player_name, uc.instance_number
-                        FROM user_cards uc
-                        JOIN cards c ON uc.card_id = c.card_id
-                        WHERE uc.instance_id = ?
-                    ''', (instance_id,))
-                    player = c.fetchone()
-                    if player:
-                        return f"{player[0]} #{player[1]}"  # Format as "Player Name #InstanceNumber"
-            return "Empty"
-
-        team_display = (
-            f"**{team_name}**\n"
-            f"🏀 Point Guard: {get_player(pg)}\n"
-            f"🏀 Shooting Guard: {get_player(sg)}\n"
-            f"🏀 Small Forward: {get_player(sf)}\n"
-            f"🏀 Power Forward: {get_player(pf)}\n"
-            f"🏀 Center: {get_player(c_)}\n"
-            f"🏀 Sixth Man: {get_player(sm)}"
-        )
+def _fetch_user_team_name(conn, discord_id):
+    # Returns (user_id, team_row) for a discord user; user_id is None if they are not registered
+    c = conn.cursor()
+
+    # Get user ID
+    c.execute("SELECT user_id FROM users WHERE discord_id = ?", (discord_id,))
+    user_row = c.fetchone()
+    if not user_row:
+        return None, None
+    user_id = user_row[0]
+
+    c.execute("SELECT team_name FROM teams WHERE user_id = ?", (user_id,))
+    return user_id, c.fetchone()
+
 
+def _set_team_position(conn, user_id, position, instance_id):
+    # Puts instance_id in the given position column if the user owns it. Returns False otherwise.
+    c = conn.cursor()
+
+    # Validate that the user owns the card
+    c.execute("SELECT card_id FROM user_cards WHERE instance_id = ? AND user_id = ?", (instance_id, user_id))
+    if not c.fetchone():
+        return False
+
+    # Update the team
+    c.execute(f"UPDATE teams SET {position} = ? WHERE user_id = ?", (instance_id, user_id))
+    refresh_team_ratings(c, (user_id,))
+    return True
+
+async def view_team(discord_id):
+    # Sends message with users' team. The rendered text is cached until invalidate_team().
+    cached = team_text_cache.get(discord_id)
+    if cached is not None:
+        return cached
+
+    version = team_text_cache.version
+    team_display, cacheable = await db.read(_render_team, discord_id)
+    if cacheable:
+        team_text_cache.put(discord_id, team_display, version)
     return team_display
+
+
+def _render_team(conn, discord_id):
+    # Returns (text, cacheable). Only a rendered team is cached, not the "no team" replies.
+    user_id, team_name, slots, _ = fetch_lineup(conn, discord_id)
+    if user_id is None:
+        return "User not found. Use `!cards` first to add yourself to the database.", False
+    if team_name is None:
+        return "You do not have a team yet. Use `!team create <team_name>` to create one.", False
+
+    # Format as "Player Name #InstanceNumber"
+    players = {position: f"{player.player_name} #{player.instance_number}" if player else "Empty"
+               for position, player in slots}
+
+    team_display = (
+        f"**{team_name}**\n"
+        f"🏀 Point Guard: {players['point_guard']}\n"
+        f"🏀 Shooting Guard: {players['shooting_guard']}\n"
+        f"🏀 Small Forward: {players['small_forward']}\n"
+        f"🏀 Power Forward: {players['power_forward']}\n"
+        f"🏀 Center: {players['center']}\n"
+        f"🏀 Sixth Man: {players['sixth_man']}"
+    )
+
+    return team_display, True
@@ -0,0 +1,137 @@
+# HOPS_tournament.py
+import os, time, asyncio, argparse, multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from HOPS_db import db
+from HOPS_engine import play_games
+
+# A round robin season: every team in `teams` plays every other team once, scored with the
+# same formula as run_game but without Discord. Team ratings are read with one query, the games are
+# split across worker processes that each play their share in NumPy batches, and the final table
+# is written to `standings`.
+
+TOURNAMENT_WORKERS = os.cpu_count() or 2
+
+
+def _load_team_ratings(conn):
+    # (user_id, team_name, offense, defense) for every team, from the totals stored on the teams table
+    return conn.execute('''
+        SELECT user_id, team_name, offensive_total, defensive_total FROM teams ORDER BY user_id
+    ''').fetchall()
+
+
+def play_shard(offense, defense, home_teams, seed):
+    # Runs in a worker process. Plays every game between each team in home_teams and every team
+    # after it, so each pair meets exactly once across all shards. Returns per-team totals of
+    # (wins, points_for, points_against) over the games in this shard.
+    rng = np.random.default_rng(seed)
+    teams = len(offense)
+    wins = np.zeros(teams, dtype=np.int64)
+    points_for = np.zeros(teams)
+    points_against = np.zeros(teams)
+
+    for home in home_teams:
+        away = np.arange(home + 1, teams)
+        if not len(away):
+            continue
+        # Team 2 wins ties, so pick sides at random rather than favouring teams late in the order
+        home_first = rng.random(len(away)) < 0.5
+        first_scores, second_scores = play_games(
+            np.where(home_first, offense[home], offense[away]), np.where(home_first, defense[home], defense[away]),
+            np.where(home_first, offense[away], offense[home]), np.where(home_first, defense[away], defense[home]),
+            len(away), rng)
+        home_scores = np.where(home_first, first_scores, second_scores)
+        away_scores = np.where(home_first, second_scores, first_scores)
+        home_won = np.where(home_first, home_scores > away_scores, home_scores >= away_scores)
+        wins[home] += home_won.sum()
+        wins[away] += ~home_won
+        points_for[home] += home_scores.sum()
+        points_for[away] += away_scores
+        points_against[home] += away_scores.sum()
+        points_against[away] += home_scores
+
+    return wins, points_for, points_against
+
+
+def _save_standings(conn, started, seed, teams, games, standings):
+    c = conn.cursor()
+    c.execute('INSERT INTO tournaments (started, seed, teams, games) VALUES (?, ?, ?, ?)',
+              (started, str(seed), teams, games))
+    tournament_id = c.lastrowid
+    c.executemany('''
+        INSERT INTO standings (tournament_id, rank, user_id, team_name, wins, losses, points_for, points_against)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(tournament_id, *row) for row in standings])
+    return tournament_id
+
+
+def _fetch_standings(conn, tournament_id, limit):
+    return conn.execute('''
+        SELECT rank, team_name, wins, losses, points_for, points_against FROM standings
+        WHERE tournament_id = ? ORDER BY rank LIMIT ?
+    ''', (tournament_id, limit)).fetchall()
+
+
+async def run_tournament(workers=TOURNAMENT_WORKERS, seed=None):
+    # Plays a full round robin and saves the standings. Returns (tournament_id, teams, games).
+    started = time.time()
+    rows = await db.read(_load_team_ratings)
+    teams = len(rows)
+    if teams < 2:
+        return None, teams, 0
+
+    offense = np.array([row[2] for row in rows], dtype=float)
+    defense = np.array([row[3] for row in rows], dtype=float)
+
+    # Dealing home teams out in turn gives every shard about the same number of games
+    seed_sequence = np.random.SeedSequence(seed)
+    shards = [np.arange(shard, teams, workers) for shard in range(min(workers, teams))]
+    loop = asyncio.get_running_loop()
+    # Spawned rather than forked, as the bot already runs database threads (see HOPS_images)
+    pool = ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn'))
+    try:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, play_shard, offense, defense, home_teams, child_seed)
+            for home_teams, child_seed in zip(shards, seed_sequence.spawn(len(shards)))
+        ))
+    finally:
+        pool.shutdown(wait=False)  # Joining the workers here would block the event loop
+
+    wins = sum(result[0] for result in results)
+    points_for = sum(result[1] for result in results)
+    points_against = sum(result[2] for result in results)
+
+    # Most wins first, then best point difference
+    order = np.lexsort((-(points_for - points_against), -wins))
+    standings = [
+        (rank, rows[team][0], rows[team][1], int(wins[team]), teams - 1 - int(wins[team]),
+         float(points_for[team]), float(points_against[team]))
+        for rank, team in enumerate(order, start=1)
+    ]
+    games = teams * (teams - 1) // 2
+    tournament_id = await db.write(_save_standings, started, seed_sequence.entropy, teams, games, standings)
+    return tournament_id, teams, games
+
+
+async def fetch_standings(tournament_id, limit=10):
+    return await db.read(_fetch_standings, tournament_id, limit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play a round robin between every team and save the standings.")
+    parser.add_argument('--workers', type=int, default=TOURNAMENT_WORKERS)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--top', type=int, default=10, help="Standings rows to print")
+    options = parser.parse_args()
+
+    async def main():
+        start = time.perf_counter()
+        tournament_id, teams, games = await run_tournament(options.workers, options.seed)
+        if tournament_id is None:
+            print(f"Need at least two teams, found {teams}.")
+            return
+        print(f"Tournament {tournament_id}: {teams} teams, {games} games in {time.perf_counter() - start:.2f}s")
+        for rank, team_name, wins, losses, points_for, points_against in await fetch_standings(tournament_id, options.top):
+            print(f"{rank:>4}. {team_name} {wins}-{losses} ({points_for:.0f}-{points_against:.0f})")
+
+    asyncio.run(main())
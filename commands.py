@@ -1,131 +1,156 @@
 #commands.py
-import discord, random, sqlite3, io, asyncio, time, string
-from player_cards import PlayerCard
-from PIL import Image
+import discord, random, sqlite3, io, asyncio, string, hashlib
+from player_cards import PlayerCard, catalog, normalize_name, load_card_records, install_cards
+from HOPS_db import db
+from HOPS_cache import invalidate_team, roster_cache, team_text_cache
+from HOPS_images import renderer, RenderQueueFull, drop_image_cache, card_image_cache
+from HOPS_interactions import interactions
 
-DATABASE_NAME = 'HOPS_prototype1.db'
 CARDS_PER_PAGE = 10
+SUMMARY_GROUPS_PER_PAGE = 25  # Player/season/condition lines per page of !collection summary
+UNKNOWN_CONDITION = "Unknown"  # Counted in place of a missing condition
+INSTANCE_ID_LENGTH = 6  # 62^6 is about 56 billion IDs before they grow a character
+BASE62_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase  # In ASCII order
 
 
-def connect_db():  # Connect to SQL database
-    retries = 5
-    while retries:
-        try:
-            return sqlite3.connect(DATABASE_NAME, timeout=10)
-        except sqlite3.OperationalError:
-            retries -= 1
-            time.sleep(1)  # Wait for 1 second before retrying
-    raise sqlite3.OperationalError("Database is locked and all retries failed.")
+async def add_user(discord_id):  # Adds user to database
+    await db.write(_add_user, discord_id)
 
 
-def add_user(discord_id):  # Adds user to database
-    with connect_db() as conn:
-        c = conn.cursor()
+def _add_user(conn, discord_id):
+    # Insert user if they don't already exist
+    conn.execute('INSERT OR IGNORE INTO users (discord_id) VALUES (?)', (discord_id,))
 
-        # Create users table if it doesn't exist
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            discord_id TEXT UNIQUE
-        )''')
 
-        # Insert user if they don't already exist
-        c.execute('INSERT OR IGNORE INTO users (discord_id) VALUES (?)', (discord_id,))
+async def user_owns_card(discord_id, player_name):
+    # Check if the user owns the specified player card by cross-referencing tables.
+    return await db.read(_user_owns_card, discord_id, player_name)
 
 
-def user_owns_card(discord_id, player_name):
-    # Check if the user owns the specified player card by cross-referencing tables.
-    conn = connect_db()
-    try:
-        c = conn.cursor()
-
-        # Case-insensitive search for the card in the 'cards' table
-        c.execute('SELECT card_id FROM cards WHERE LOWER(player_name) = LOWER(?)', (player_name,))
-        card_row = c.fetchone()
-        if not card_row:
-            return False, "This card does not exist."
-        card_id = card_row[0]
-
-        # Find the internal user id based on the discord_id
-        c.execute('SELECT user_id FROM users WHERE discord_id = ?', (discord_id,))
-        user_row = c.fetchone()
-        if not user_row:
-            return False, "User not found. Please register first."
-        user_id = user_row[0]
-
-        # Check if the user owns the card in 'user_cards'
-        c.execute('SELECT * FROM user_cards WHERE user_id = ? AND card_id = ?', (user_id, card_id))
-        if not c.fetchone():
-            return False, "You don't own this card."
-
-        return True, "Card found in your collection."
-
-    finally:
-        conn.close()
-
-
-def initialize_cards_table():
-    # Ensure the cards table exists with the correct structure.
-
-    with connect_db() as conn:
-        c = conn.cursor()
-        # Create table if it doesn't exist
-        c.execute(''' 
-            CREATE TABLE IF NOT EXISTS cards (
-                card_id INTEGER PRIMARY KEY,
-                player_name TEXT NOT NULL,
-                position INTEGER NOT NULL,
-                season_year INTEGER NOT NULL,
-                stats TEXT NOT NULL,
-                offensive_rating REAL NOT NULL,
-                defensive_rating REAL NOT NULL,
-                attributes TEXT NOT NULL  -- New attribute for storing player-specific attributes
-            )
-        ''')
-        conn.commit()
+def _user_owns_card(conn, discord_id, player_name):
+    c = conn.cursor()
+
+    # Case-insensitive search for the card in the 'cards' table
+    c.execute('SELECT card_id FROM cards WHERE name_key = ?', (normalize_name(player_name),))
+    card_row = c.fetchone()
+    if not card_row:
+        return False, "This card does not exist."
+    card_id = card_row[0]
+
+    # Find the internal user id based on the discord_id
+    c.execute('SELECT user_id FROM users WHERE discord_id = ?', (discord_id,))
+    user_row = c.fetchone()
+    if not user_row:
+        return False, "User not found. Please register first."
+    user_id = user_row[0]
+
+    # Check if the user owns the card in 'user_cards'
+    c.execute('SELECT * FROM user_cards WHERE user_id = ? AND card_id = ?', (user_id, card_id))
+    if not c.fetchone():
+        return False, "You don't own this card."
+
+    return True, "Card found in your collection."
 
 
 def sync_player_cards_to_db():
     #Sync all PlayerCard instances to the database. Ensures all cards in PlayerCard are inserted or updated in the cards table.
+    # Returns the number of rows written.
+
+    with db.writer() as conn:
+        return sync_cards(conn, PlayerCard.cards)
+
+
+def card_row(card):
+    # The cards table row for a PlayerCard, plus a hash of its contents
+    data = (
+        card.card_id,  # card_id
+        card.player_name,  # player_name
+        card.position,  # position
+        card.season_year,  # season_year
+        str(card.stats),  # stats as a string
+        card.offensive_rating,  # offensive_rating
+        card.defensive_rating,  # defensive_rating
+        str(card.attributes),  # attributes as a string
+        normalize_name(card.player_name)  # name_key for indexed lookups
+    )
+    return data + (hashlib.sha1(repr(data).encode()).hexdigest(),)
+
+
+def sync_cards(conn, cards):
+    # Upserts only the cards that are new or whose content hash changed, in one executemany.
+    # Runs inside the caller's write transaction. Returns the number of rows written.
+    stored_hashes = dict(conn.execute('SELECT card_id, content_hash FROM cards'))
+    changed = [row for row in map(card_row, cards) if stored_hashes.get(row[0]) != row[-1]]
+    rating_changed = any(row[0] in stored_hashes for row in changed)
+
+    conn.executemany(''' 
+        INSERT INTO cards (card_id, player_name, position, season_year, stats, offensive_rating, defensive_rating, attributes, name_key, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(card_id) DO UPDATE SET
+            player_name = excluded.player_name,
+            position = excluded.position,
+            season_year = excluded.season_year,
+            stats = excluded.stats,
+            offensive_rating = excluded.offensive_rating,
+            defensive_rating = excluded.defensive_rating,
+            attributes = excluded.attributes,
+            name_key = excluded.name_key,
+            content_hash = excluded.content_hash
+    ''', changed)
+    if rating_changed:
+        refresh_team_ratings(conn)  # Existing cards changed, possibly their ratings
+    return len(changed)
+
+
+reload_lock = asyncio.Lock()
+
+
+async def reload_player_cards():
+    # Re-reads the card manifest while the bot keeps running. Only new or changed cards are
+    # written to the cards table, and the catalog indexes are swapped in one step afterwards.
+    # A card counts as changed if its row, image path or image file's mtime did, so replaced art
+    # is re-rendered; the rendered PNGs of every other card stay cached under their card_id.
+    # Returns (added, changed, removed, rows_written).
+    async with reload_lock:
+        new_cards = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [PlayerCard(*record) for record in load_card_records()])  # Stats each image file
+        live = catalog.index.by_id
+
+        cards, changed_ids = [], []
+        added = 0
+        for card in new_cards:
+            current = live.get(card.card_id)
+            if current is None:
+                added += 1
+            elif (card_row(current) != card_row(card) or current.image_path != card.image_path
+                  or current.image_version != card.image_version):
+                changed_ids.append(card.card_id)
+            else:
+                card = current
+            cards.append(card)
+        removed = len(live.keys() - {card.card_id for card in cards})
 
-    with connect_db() as conn:
-        c = conn.cursor()
-
-        for card in PlayerCard.cards:
-            # Prepare data for insertion or update
-            data = (
-                card.card_id,  # card_id
-                card.player_name,  # player_name
-                card.position,  # position
-                card.season_year,  # season_year
-                str(card.stats),  # stats as a string
-                card.offensive_rating,  # offensive_rating
-                card.defensive_rating,  # defensive_rating
-                str(card.attributes)  # attributes as a string
-            )
+        rows_written = await db.write(sync_cards, cards)
+        install_cards(cards)
+
+        if changed_ids or removed:
+            # Names, ratings or images may have changed under cached teams and renders
+            for card_id in changed_ids:
+                card_image_cache.pop(card_id)
+            drop_image_cache.clear()
+            roster_cache.clear()
+            team_text_cache.clear()
+
+        return added, len(changed_ids), removed, rows_written
 
-            # Insert or update the card
-            c.execute(''' 
-                INSERT INTO cards (card_id, player_name, position, season_year, stats, offensive_rating, defensive_rating, attributes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(card_id) DO UPDATE SET
-                    player_name = excluded.player_name,
-                    position = excluded.position,
-                    season_year = excluded.season_year,
-                    stats = excluded.stats,
-                    offensive_rating = excluded.offensive_rating,
-                    defensive_rating = excluded.defensive_rating,
-                    attributes = excluded.attributes
-            ''', data)
-
-        conn.commit()
-
-def get_user_id(discord_id):
+
+async def get_user_id(discord_id):
     # Get user_id from discord_id.
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute('SELECT user_id FROM users WHERE discord_id = ?', (discord_id,))
-    user_id = c.fetchone()
-    conn.close()
+    return await db.read(_get_user_id, discord_id)
+
+
+def _get_user_id(conn, discord_id):
+    user_id = conn.execute('SELECT user_id FROM users WHERE discord_id = ?', (discord_id,)).fetchone()
     return user_id[0] if user_id else None
 
 def get_random_condition():
@@ -138,96 +163,163 @@ def generate_card_id():
     # Generate a unique six-character alphanumeric ID for the card.
     return ''.join(random.choices(string.ascii_letters + string.digits, k=6))
 
-def generate_card_instance_id():
-    # Generates a random 6-character alphanumeric string for the instance ID.
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+def encode_base62(number, width=INSTANCE_ID_LENGTH):
+    # Fixed-width base62, so IDs of the same length sort in numeric order
+    digits = []
+    while number:
+        number, remainder = divmod(number, 62)
+        digits.append(BASE62_ALPHABET[remainder])
+    return ''.join(reversed(digits)).rjust(width, BASE62_ALPHABET[0])
+
+
+def generate_card_instance_id(c):
+    # Takes the next value of the instance ID sequence and encodes it as a short base62 string.
+    # IDs are increasing, so inserts land at the end of the instance_id index, and unique as long as
+    # this runs inside the claim's write transaction. Values that hit one of the old random IDs are skipped.
+    while True:
+        c.execute(
+            """
+            INSERT INTO id_sequences (name, value) VALUES ('instance_id', 0)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1
+            """
+        )
+        c.execute("SELECT value FROM id_sequences WHERE name = 'instance_id'")
+        instance_id = encode_base62(c.fetchone()[0])
+        c.execute("SELECT 1 FROM user_cards WHERE instance_id = ?", (instance_id,))
+        if c.fetchone() is None:
+            return instance_id
 
 
-def add_card_to_user(discord_id, player_name, season_year):
+async def add_card_to_user(discord_id, player_name, season_year):
     # Adds card to user's collection in the database
+    return await db.write(_add_card_to_user, discord_id, player_name, season_year)
 
-    with connect_db() as conn:
-        c = conn.cursor()
 
-        # Get the internal user ID using the Discord ID
-        c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (discord_id,))
-        user_row = c.fetchone()
+def _add_card_to_user(conn, discord_id, player_name, season_year):
+    c = conn.cursor()
 
-        if not user_row:
-            return "User not found in the database."
+    # Get the internal user ID using the Discord ID
+    c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (discord_id,))
+    user_row = c.fetchone()
 
-        user_id, current_cash = user_row
+    if not user_row:
+        return "User not found in the database."
 
-        # Validate the card exists in the cards table and fetch additional data
-        c.execute(
-            """
-            SELECT card_id, offensive_rating, defensive_rating, attributes 
-            FROM cards 
-            WHERE LOWER(player_name) = ? AND season_year = ?
-            """,
-            (player_name.lower(), season_year),
-        )
-        card_row = c.fetchone()
+    user_id, current_cash = user_row
+
+    # Validate the card exists in the cards table and fetch additional data
+    c.execute(
+        """
+        SELECT card_id, offensive_rating, defensive_rating, attributes 
+        FROM cards 
+        WHERE name_key = ? AND season_year = ?
+        """,
+        (normalize_name(player_name), season_year),
+    )
+    card_row = c.fetchone()
+
+    if not card_row:
+        return f"Card for {player_name} ({season_year}) not found."
 
-        if not card_row:
-            return f"Card for {player_name} ({season_year}) not found."
+    card_id = card_row[0]  # Generic card ID from the cards table
+    offensive_rating = card_row[1]
+    defensive_rating = card_row[2]
+    attributes = card_row[3]
 
-        card_id = card_row[0]  # Generic card ID from the cards table
-        offensive_rating = card_row[1]
-        defensive_rating = card_row[2]
-        attributes = card_row[3]
+    # Take the next instance_number for this card_id (GLOBAL, across all users). The counter is bumped
+    # in the same transaction as the insert below, so two claims can never get the same serial.
+    next_instance_number = next_card_serial(c, card_id)
 
-        # Determine the next instance_number for this card_id (GLOBAL, across all users)
+    # Generate a unique alphanumeric instance ID
+    instance_id = generate_card_instance_id(c)
+
+    # Assign a random condition to the card
+    condition_probabilities = {"Injured": 0.1, "Injury Watch": 0.15, "Healthy": 0.7, "Peak Condition": 0.05}
+    condition = random.choices(
+        list(condition_probabilities.keys()), weights=list(condition_probabilities.values()), k=1
+    )[0]
+
+    # Insert the new card instance into the user_cards table
+    try:
         c.execute(
             """
-            SELECT MAX(instance_number) FROM user_cards
-            WHERE card_id = ?
+            INSERT INTO user_cards (instance_id, user_id, card_id, instance_number, condition, offensive_rating, defensive_rating, attributes) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            (card_id,),
+            (instance_id, user_id, card_id, next_instance_number, condition, offensive_rating, defensive_rating,
+             attributes),
         )
-        max_instance_number = c.fetchone()[0]
-        next_instance_number = 1 if max_instance_number is None else max_instance_number + 1
-
-        # Generate a unique alphanumeric instance ID
-        instance_id = generate_card_instance_id()
-
-        # Assign a random condition to the card
-        condition_probabilities = {"Injured": 0.1, "Injury Watch": 0.15, "Healthy": 0.7, "Peak Condition": 0.05}
-        condition = random.choices(
-            list(condition_probabilities.keys()), weights=list(condition_probabilities.values()), k=1
-        )[0]
-
-        # Insert the new card instance into the user_cards table
-        try:
-            c.execute(
-                """
-                INSERT INTO user_cards (instance_id, user_id, card_id, instance_number, condition, offensive_rating, defensive_rating, attributes) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (instance_id, user_id, card_id, next_instance_number, condition, offensive_rating, defensive_rating,
-                 attributes),
-            )
-
-            # Add $100 Court Cash to the user
-            if current_cash is None:
-                current_cash = 0
-            new_cash_balance = current_cash + 100
-            c.execute("UPDATE users SET court_cash = ? WHERE user_id = ?", (new_cash_balance, user_id))
-
-            conn.commit()
 
-            # Prepare condition-specific messages
-            condition_messages = {
-                "Injured": f"You claimed {player_name}, {season_year} #{next_instance_number}, but unfortunately, he's **Injured**! You also received **$100 Court Cash**.",
-                "Injury Watch": f"You claimed {player_name}, {season_year} #{next_instance_number}, but he's on **Injury Watch**. Be cautious! You also received **$100 Court Cash**.",
-                "Healthy": f"You claimed {player_name}, {season_year} #{next_instance_number}, and he's **Healthy**. Good luck! You also received **$100 Court Cash**.",
-                "Peak Condition": f"You claimed {player_name}, {season_year} #{next_instance_number}, and he's in **Peak Condition**! Amazing find! You also received **$100 Court Cash**.",
-            }
+        # Add $100 Court Cash to the user
+        if current_cash is None:
+            current_cash = 0
+        new_cash_balance = current_cash + 100
+        c.execute("UPDATE users SET court_cash = ? WHERE user_id = ?", (new_cash_balance, user_id))
+        count_cards(c, user_id, card_id, condition, 1)
+
+        # Prepare condition-specific messages
+        condition_messages = {
+            "Injured": f"You claimed {player_name}, {season_year} #{next_instance_number}, but unfortunately, he's **Injured**! You also received **$100 Court Cash**.",
+            "Injury Watch": f"You claimed {player_name}, {season_year} #{next_instance_number}, but he's on **Injury Watch**. Be cautious! You also received **$100 Court Cash**.",
+            "Healthy": f"You claimed {player_name}, {season_year} #{next_instance_number}, and he's **Healthy**. Good luck! You also received **$100 Court Cash**.",
+            "Peak Condition": f"You claimed {player_name}, {season_year} #{next_instance_number}, and he's in **Peak Condition**! Amazing find! You also received **$100 Court Cash**.",
+        }
+
+        return condition_messages[condition]
+
+    except sqlite3.IntegrityError as e:
+        conn.rollback()  # Give the serial back
+        return f"An error occurred while adding the card: {str(e)}"
+
+
+def count_cards(c, user_id, card_id, condition, delta):
+    # Keeps user_card_counts in step with user_cards. Call in the same transaction as every
+    # insert of a card instance or change of its owner.
+    condition = condition or UNKNOWN_CONDITION
+    c.execute(
+        """
+        INSERT INTO user_card_counts (user_id, card_id, condition, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, card_id, condition) DO UPDATE SET count = count + excluded.count
+        """,
+        (user_id, card_id, condition, delta),
+    )
+    if delta < 0:
+        c.execute("DELETE FROM user_card_counts WHERE user_id = ? AND card_id = ? AND condition = ? AND count <= 0",
+                  (user_id, card_id, condition))
+
+
+def refresh_team_ratings(c, user_ids=None):
+    # Re-sums the offensive_total/defensive_total stored on these users' teams (every team if
+    # user_ids is None) slot by slot, as HOPS_teams.fetch_lineup fills them, from the lineup cards
+    # they still own. Call in the same transaction as anything that changes a lineup, moves a card
+    # between users, or changes card ratings.
+    query = """
+        UPDATE teams SET (offensive_total, defensive_total) = (
+            SELECT COALESCE(SUM(cards.offensive_rating), 0), COALESCE(SUM(cards.defensive_rating), 0)
+            FROM (SELECT teams.point_guard AS instance_id UNION ALL SELECT teams.shooting_guard
+                  UNION ALL SELECT teams.small_forward UNION ALL SELECT teams.power_forward
+                  UNION ALL SELECT teams.center UNION ALL SELECT teams.sixth_man) AS lineup
+            JOIN user_cards ON user_cards.instance_id = lineup.instance_id AND user_cards.user_id = teams.user_id
+            JOIN cards ON cards.card_id = user_cards.card_id
+        )
+    """
+    if user_ids is None:
+        c.execute(query)
+    else:
+        c.executemany(query + " WHERE user_id = ?", [(user_id,) for user_id in user_ids])
 
-            return condition_messages[condition]
 
-        except sqlite3.IntegrityError as e:
-            return f"An error occurred while adding the card: {str(e)}"
+def next_card_serial(c, card_id):
+    # Increments and returns the card's serial counter. Must run inside the claim's write transaction.
+    c.execute(
+        """
+        INSERT INTO card_serials (card_id, last_serial) VALUES (?, 1)
+        ON CONFLICT(card_id) DO UPDATE SET last_serial = last_serial + 1
+        """,
+        (card_id,),
+    )
+    c.execute("SELECT last_serial FROM card_serials WHERE card_id = ?", (card_id,))
+    return c.fetchone()[0]
 
 def pick_random_cards(num_cards=3):
     all_cards = PlayerCard.get_cards()
@@ -236,34 +328,7 @@ def pick_random_cards(num_cards=3):
 
     return random.sample(all_cards, num_cards)
 
-def compile_images(cards): # Creates image of three cards
-    images = [card.image for card in cards if card.image is not None]
-
-    if not images:
-        print("No images found for the selected cards.")
-        return None
-
-    total_width = sum(image.width for image in images)
-    max_height = max(image.height for image in images)
-
-    # Create a transparent background for the compiled image
-    compiled_image = Image.new("RGBA", (total_width, max_height), (0, 0, 0, 0))
-
-    x_offset = 0
-    for img in images:
-        compiled_image.paste(img, (x_offset, 0), img if img.mode == 'RGBA' else None)
-        x_offset += img.width
-
-    # Save to a BytesIO object instead of a file
-    img_byte_arr = io.BytesIO()
-    compiled_image.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)  # Move to the beginning of the BytesIO object
-
-    return img_byte_arr
-
-# To store cooldown information and expiration timestamps for card drops
-user_cooldowns = {}
-card_drop_expiration_times = {}
+DROP_LIFETIME = 60  # Seconds a card drop can be claimed for
 
 async def send_player_cards(channel, user_id, bot):
     # Pick 3 random cards
@@ -273,11 +338,15 @@ async def send_player_cards(channel, user_id, bot):
         return
 
     # Compile images for the selected cards
-    compiled_image = compile_images(selected_cards)
-    message = await channel.send(file=discord.File(compiled_image, filename='compiled_player_cards.png'))
-
-    # Set expiration time for the card drop
-    card_drop_expiration_times[message.id] = time.time() + 60  # Expires after 1 minute
+    try:
+        compiled_image = await renderer.drop_image(selected_cards)
+    except RenderQueueFull:
+        await channel.send("Too many card drops are being dealt right now. Try again in a moment.")
+        return
+    if compiled_image is None:
+        await channel.send("Could not load the images for this drop.")
+        return
+    message = await channel.send(file=discord.File(io.BytesIO(compiled_image), filename='compiled_player_cards.png'))
 
     # Add reactions to the message for card selection
     emoji_list = ['1️⃣', '2️⃣', '3️⃣']
@@ -285,60 +354,99 @@ async def send_player_cards(channel, user_id, bot):
         await message.add_reaction(emoji)
 
 
-    # Wait for a reaction from the user
-    def check(reaction, user):
-        # Check expiration before allowing claim
-        if time.time() > card_drop_expiration_times.get(message.id, 0):
-            return False
-        return user != message.guild.me and str(reaction.emoji) in emoji_list and reaction.message.id == message.id
-
+    # Wait for a reaction from any user. Once the drop expires the scheduler closes the message
+    # and later reactions are ignored.
     try:
-        reaction, user = await bot.wait_for('reaction_add', timeout=60.0, check=check)
+        reaction, user = await interactions.wait_for_reaction(
+            message, emoji_list, timeout=DROP_LIFETIME, on_expire=lambda: close_expired_drop(message))
     except asyncio.TimeoutError:
-        await channel.send("The card drop has expired!")
-    else:
-        if time.time() > card_drop_expiration_times[message.id]:  # Re-check expiration
-            await channel.send("The card drop has expired!")
-        else:
-            chosen_card_index = emoji_list.index(str(reaction.emoji))
-            chosen_card = selected_cards[chosen_card_index]
-            response = add_card_to_user(user.id, chosen_card.player_name, chosen_card.season_year)
-            await channel.send(response)
-
-    # Clean up expired card drop data
-    card_drop_expiration_times.pop(message.id, None)
-
-async def view_collection(channel, discord_id, bot):
-    conn = sqlite3.connect(DATABASE_NAME)
-    c = conn.cursor()
-
-    # Fetch the user's cards along with instance numbers, instance ids, and condition
-    c.execute('''SELECT cards.player_name, cards.season_year, user_cards.instance_number, 
-                         user_cards.instance_id AS instance_id, user_cards.condition
-                  FROM user_cards
-                  JOIN cards ON user_cards.card_id = cards.card_id
-                  WHERE user_cards.user_id = (SELECT user_id FROM users WHERE discord_id = ?)
-              ''', (discord_id,))
-
-    user_cards = c.fetchall()
-    conn.close()
+        return
 
-    if not user_cards:
+    chosen_card_index = emoji_list.index(str(reaction.emoji))
+    chosen_card = selected_cards[chosen_card_index]
+    response = await add_card_to_user(user.id, chosen_card.player_name, chosen_card.season_year)
+    await channel.send(response)
+
+async def close_expired_drop(message):
+    # Marks an unclaimed drop as expired in place, instead of posting a new message
+    await message.edit(content="The card drop has expired!")
+    if message.guild:  # Bots can't remove reactions in DMs
+        await message.clear_reactions()
+
+# Sort orders for !collection: the key columns pages are ordered and resumed by, and whether
+# they run newest first. Each is served by an index on (user_id, key columns); user_cards.rowid
+# is the order cards were claimed in and breaks ties.
+COLLECTION_SORTS = {
+    "recent": (("user_cards.rowid",), True),
+    "serial": (("user_cards.instance_number", "user_cards.rowid"), False),
+    "card": (("user_cards.card_id", "user_cards.instance_number", "user_cards.rowid"), False),
+}
+DEFAULT_COLLECTION_SORT = "recent"
+
+
+def _count_collection(conn, user_id):
+    return conn.execute('SELECT COALESCE(SUM(count), 0) FROM user_card_counts WHERE user_id = ?',
+                        (user_id,)).fetchone()[0]
+
+
+def _fetch_collection_summary(conn, user_id):
+    # One row per player/season/condition the user owns, from the per-user aggregate
+    return conn.execute('''SELECT cards.player_name, cards.season_year, user_card_counts.condition, user_card_counts.count
+                           FROM user_card_counts
+                           JOIN cards ON user_card_counts.card_id = cards.card_id
+                           WHERE user_card_counts.user_id = ?
+                           ORDER BY cards.player_name, cards.season_year, user_card_counts.condition
+                        ''', (user_id,)).fetchall()
+
+
+def _fetch_collection_page(conn, user_id, sort, after=None, backward=False, offset=0):
+    # Fetches one page of a user's cards in `sort` order. With `after` (the key of the last row of
+    # the previous page, or of the first row when going backward) the page starts right after it
+    # using the index, so flipping pages costs the same at page 1 and page 5000. Only a direct
+    # jump to a page uses OFFSET. Rows are (player_name, season_year, instance_number,
+    # instance_id, condition, *key).
+    columns, newest_first = COLLECTION_SORTS[sort]
+    descending = newest_first != backward
+    key = ", ".join(columns)
+    query = f'''SELECT cards.player_name, cards.season_year, user_cards.instance_number,
+                      user_cards.instance_id, user_cards.condition, {key}
+               FROM user_cards
+               JOIN cards ON user_cards.card_id = cards.card_id
+               WHERE user_cards.user_id = ?'''
+    params = [user_id]
+    if after is not None:
+        query += f" AND ({key}) {'<' if descending else '>'} ({', '.join('?' * len(columns))})"
+        params.extend(after)
+    query += " ORDER BY " + ", ".join(column + (" DESC" if descending else "") for column in columns)
+    query += " LIMIT ? OFFSET ?"
+    params.extend((CARDS_PER_PAGE, offset))
+
+    rows = conn.execute(query, params).fetchall()
+    if backward:
+        rows.reverse()
+    return rows
+
+
+async def view_collection(channel, discord_id, bot, sort=DEFAULT_COLLECTION_SORT, page=1):
+    user_id = await get_user_id(discord_id)
+    total_cards = await db.read(_count_collection, user_id) if user_id is not None else 0
+
+    if not total_cards:
         await channel.send("You don't have any cards in your collection.")
         return
 
-    # Define pagination variables
-    total_cards = len(user_cards)
+    # Define pagination variables. Only the page on screen is kept in memory.
+    key_length = len(COLLECTION_SORTS[sort][0])
     total_pages = (total_cards + CARDS_PER_PAGE - 1) // CARDS_PER_PAGE
-    current_page = 0
+    current_page = min(max(page, 1), total_pages) - 1
+    cards_on_page = await db.read(_fetch_collection_page, user_id, sort, None, False, current_page * CARDS_PER_PAGE)
 
     def generate_page_content(page_index):
         start = page_index * CARDS_PER_PAGE
-        end = start + CARDS_PER_PAGE
-        cards_on_page = user_cards[start:end]
 
-        content = f"**Your Collection - Page {page_index + 1}/{total_pages}:**\n"
-        for idx, (player_name, season_year, instance_number, instance_id, condition) in enumerate(cards_on_page, start=start + 1):
+        content = f"**Your Collection ({sort}) - Page {page_index + 1}/{total_pages}:**\n"
+        for idx, row in enumerate(cards_on_page, start=start + 1):
+            player_name, season_year, instance_number, instance_id, condition = row[:-key_length]
             content += f"{idx}. {player_name}, {season_year} #{instance_number} (ID: {instance_id}) - Condition: {condition}\n"
 
         return content
@@ -351,24 +459,70 @@ async def view_collection(channel, discord_id, bot):
         await message.add_reaction("◀️")
         await message.add_reaction("▶️")
 
-        # Reaction check function
-        def check(reaction, user):
-            return (user != bot.user and
-                    str(reaction.emoji) in ["◀️", "▶️"] and
-                    reaction.message.id == message.id)
+        while True:
+            try:
+                reaction, user = await interactions.wait_for_reaction(message, ["◀️", "▶️"])
+                await message.remove_reaction(reaction.emoji, user)
+
+                # Fetch the neighbouring page, keyed off the row at the edge of this one
+                rows = None
+                if reaction.emoji == "▶️" and current_page < total_pages - 1:
+                    rows = await db.read(_fetch_collection_page, user_id, sort, cards_on_page[-1][-key_length:])
+                    step = 1
+                elif reaction.emoji == "◀️" and current_page > 0:
+                    rows = await db.read(_fetch_collection_page, user_id, sort, cards_on_page[0][-key_length:], True)
+                    step = -1
+                if not rows:
+                    continue  # Already at the end, or the collection shrank since the count
+                cards_on_page = rows
+                current_page += step
+
+                # Edit the message to show the new page
+                await message.edit(content=generate_page_content(current_page))
+
+            except asyncio.TimeoutError:
+                await message.clear_reactions()
+                break
+            except Exception as e:
+                print(f"An unexpected error occurred: {e}")
+
+
+async def view_collection_summary(channel, discord_id, bot):
+    # !collection summary: how many copies of each player/season/condition the user owns
+    user_id = await get_user_id(discord_id)
+    groups = await db.read(_fetch_collection_summary, user_id) if user_id is not None else []
+
+    if not groups:
+        await channel.send("You don't have any cards in your collection.")
+        return
+
+    total_cards = sum(count for _, _, _, count in groups)
+    total_pages = (len(groups) + SUMMARY_GROUPS_PER_PAGE - 1) // SUMMARY_GROUPS_PER_PAGE
+    current_page = 0
+
+    def generate_page_content(page_index):
+        start = page_index * SUMMARY_GROUPS_PER_PAGE
+        content = f"**Your Collection Summary ({total_cards} cards) - Page {page_index + 1}/{total_pages}:**\n"
+        for player_name, season_year, condition, count in groups[start:start + SUMMARY_GROUPS_PER_PAGE]:
+            content += f"{player_name}, {season_year} - {condition}: x{count}\n"
+        return content
+
+    message = await channel.send(generate_page_content(current_page))
+
+    if total_pages > 1:
+        await message.add_reaction("◀️")
+        await message.add_reaction("▶️")
 
         while True:
             try:
-                reaction, user = await bot.wait_for('reaction_add', timeout=60.0, check=check)
+                reaction, user = await interactions.wait_for_reaction(message, ["◀️", "▶️"])
                 await message.remove_reaction(reaction.emoji, user)
 
-                # Update current_page based on the reaction
                 if reaction.emoji == "▶️" and current_page < total_pages - 1:
                     current_page += 1
                 elif reaction.emoji == "◀️" and current_page > 0:
                     current_page -= 1
 
-                # Edit the message to show the new page
                 await message.edit(content=generate_page_content(current_page))
 
             except asyncio.TimeoutError:
@@ -385,20 +539,17 @@ async def send_card_stats(channel, discord_id, player_name):
         if player_name:
             print(f"Searching for player name: {player_name}")
 
-            # Log contents of PlayerCard.cards for debugging
-            print("Contents of PlayerCard.cards:", [card.player_name for card in PlayerCard.cards])
-
-            # Retrieve specific card by player_name from PlayerCard.cards
-            card = next(
-                (card for card in PlayerCard.cards if card.player_name.lower().strip() == player_name.lower().strip()),
-                None
-            )
+            # Retrieve specific card by player_name from the catalog, also accepting "<name> <season>"
+            card = catalog.by_name(player_name)
+            if not card and ' ' in player_name.strip():
+                name, season_year = player_name.strip().rsplit(' ', 1)
+                card = catalog.by_name_season(name, season_year)
 
             if not card:
                 print(f"No matching card found for player: {player_name}")
         else:
             # If no player_name, get the most recently claimed card using discord_id
-            card = get_last_claimed_card(discord_id)
+            card = await get_last_claimed_card(discord_id)
 
         if isinstance(card, PlayerCard):
             # Prepare the message with stats, including offensive and defensive ratings, attributes, condition, and positions
@@ -413,11 +564,9 @@ async def send_card_stats(channel, discord_id, player_name):
             await channel.send(stats_message)
 
             # Send the image if available
-            if card.image:
-                img_byte_arr = io.BytesIO()
-                card.image.save(img_byte_arr, format='PNG')
-                img_byte_arr.seek(0)
-                await channel.send(file=discord.File(img_byte_arr, filename='card_image.png'))
+            png = await renderer.card_image(card)
+            if png:
+                await channel.send(file=discord.File(io.BytesIO(png), filename='card_image.png'))
             else:
                 await channel.send("No image available for this card.")
         else:
@@ -428,65 +577,54 @@ async def send_card_stats(channel, discord_id, player_name):
 
 
 
-def get_last_claimed_card(discord_id):
+async def get_last_claimed_card(discord_id):
     # This is so !stats automatically prints the stats of the last player collected, if no other player is specified
-    conn = sqlite3.connect('HOPS_prototype1.db')
-    cursor = conn.cursor()
-
     try:
-        # Step 1: Retrieve user_id from users table using discord_id
-        cursor.execute("SELECT user_id FROM users WHERE discord_id = ?", (discord_id,))
-        user_record = cursor.fetchone()
-
-        if user_record is None:
-            print(f"No user found for Discord ID {discord_id}")
-            return None
-
-        HOPS_user_id = user_record[0]
-        print(f"Found HOPS User ID: {HOPS_user_id} for Discord ID {discord_id}")
-
-        # Step 2: Use the retrieved user_id to fetch the most recent card claimed by the user
-        cursor.execute("""
-            SELECT card_id 
-            FROM user_cards 
-            WHERE user_id = ? 
-            ORDER BY rowid DESC 
-            LIMIT 1
-        """, (HOPS_user_id,))
-        card_record = cursor.fetchone()
-
-        if card_record is None:
-            print(f"No cards found for HOPS User ID {HOPS_user_id}")
-            return None
+        return await db.read(_get_last_claimed_card, discord_id)
+    except Exception as e:
+        print(f"Error in get_last_claimed_card: {e}")
+        return None
 
-        last_card_id = card_record[0]
-        print(f"Found last claimed card ID: {last_card_id} for HOPS User ID {HOPS_user_id}")
 
-        # Step 3: Retrieve player name for the found card ID from the cards table
-        cursor.execute("SELECT player_name FROM cards WHERE card_id = ?", (last_card_id,))
-        card_info = cursor.fetchone()
+def _get_last_claimed_card(conn, discord_id):
+    cursor = conn.cursor()
 
-        if card_info is None:
-            print(f"No card data found for card ID {last_card_id}")
-            return None
+    # Step 1: Retrieve user_id from users table using discord_id
+    cursor.execute("SELECT user_id FROM users WHERE discord_id = ?", (discord_id,))
+    user_record = cursor.fetchone()
 
-        player_name = card_info[0]
-        print(f"Found player name: {player_name} for card ID {last_card_id}")
+    if user_record is None:
+        print(f"No user found for Discord ID {discord_id}")
+        return None
 
-        # Step 4: Retrieve the corresponding PlayerCard instance based on the player name
-        card = next((card for card in PlayerCard.cards if card.player_name.lower() == player_name.lower()), None)
+    HOPS_user_id = user_record[0]
+    print(f"Found HOPS User ID: {HOPS_user_id} for Discord ID {discord_id}")
+
+    # Step 2: Use the retrieved user_id to fetch the most recent card claimed by the user
+    cursor.execute("""
+        SELECT card_id 
+        FROM user_cards 
+        WHERE user_id = ? 
+        ORDER BY rowid DESC 
+        LIMIT 1
+    """, (HOPS_user_id,))
+    card_record = cursor.fetchone()
+
+    if card_record is None:
+        print(f"No cards found for HOPS User ID {HOPS_user_id}")
+        return None
 
-        if card is None:
-            print(f"No matching PlayerCard instance found for player name: {player_name}")
-            return None
+    last_card_id = card_record[0]
+    print(f"Found last claimed card ID: {last_card_id} for HOPS User ID {HOPS_user_id}")
 
-        return card
+    # Step 3: Retrieve the corresponding PlayerCard instance from the catalog
+    card = catalog.by_id(last_card_id)
 
-    except Exception as e:
-        print(f"Error in get_last_claimed_card: {e}")
+    if card is None:
+        print(f"No matching PlayerCard instance found for card ID: {last_card_id}")
         return None
-    finally:
-        conn.close()
+
+    return card
 
 async def trade_card(message, target_user: discord.Member, offer: str, bot: discord.Client):
     # Two players make a trade
@@ -494,158 +632,95 @@ async def trade_card(message, target_user: discord.Member, offer: str, bot: disc
     sender_id = sender.id
     target_user_id = target_user.id
 
-    with connect_db() as conn:
-        c = conn.cursor()
-
-        # Retrieve user IDs & balances from the database
-        c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (sender_id,))
-        sender_row = c.fetchone()
-        c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (target_user_id,))
-        receiver_row = c.fetchone()
-
-        if not sender_row or not receiver_row:
-            await message.channel.send("One of the users is not found in the database.")
-            return
-
-        sender_user_id, sender_cash = sender_row
-        receiver_user_id, receiver_cash = receiver_row
-
-        # Parse offer
-        offer_details = offer.strip().split()
-        sender_cards, sender_cash_offer = [], 0
-
-        for item in offer_details:
-            if item.startswith("$"):  # If it's cash
-                try:
-                    sender_cash_offer = int(item[1:])
-                except ValueError:
-                    await message.channel.send("Invalid cash amount. Please enter a valid number.")
-                    return
-            else:  # Assume it's a card
-                c.execute("""
-                    SELECT cards.player_name, user_cards.instance_number, user_cards.instance_id
-                    FROM user_cards
-                    INNER JOIN cards ON user_cards.card_id = cards.card_id
-                    WHERE user_cards.instance_id = ? AND user_cards.user_id = ?
-                """, (item, sender_user_id))
-
-                card_row = c.fetchone()
-                if card_row:
-                    sender_cards.append(f"{card_row[0]} #{card_row[1]} ({item})")  # Format with player_name, instance_number, and instance_id
-                else:
-                    await message.channel.send(f"You do not own the card with Instance ID `{item}`.")
-                    return
-
-        # Check if sender has enough Court Cash
-        if sender_cash < sender_cash_offer:
-            await message.channel.send("You do not have enough Court Cash to make this offer.")
-            return
-
-        # Format trade message
-        sender_offer_str = ", ".join(sender_cards) + (f" and ${sender_cash_offer}" if sender_cash_offer else "")
-        trade_msg = await message.channel.send(
-            f"{target_user.mention}, {sender.mention} is offering `{sender_offer_str}`. Do you accept or decline?"
-        )
-        await trade_msg.add_reaction("✅")
-        await trade_msg.add_reaction("❌")
-
-        def check_reaction(reaction, user):
-            return user == target_user and reaction.message.id == trade_msg.id and str(reaction.emoji) in ["✅", "❌"]
-
-        try:
-            reaction, _ = await bot.wait_for("reaction_add", timeout=60.0, check=check_reaction)
-        except asyncio.TimeoutError:
-            await message.channel.send("Trade request timed out.")
-            return
-
-        if str(reaction.emoji) == "❌":
-            await message.channel.send("Trade Offer Declined.")
-            return
-
-        await message.channel.send(f"{target_user.mention}, input your return offer using `!return <Cards/Cash>`.")
-
-        def check_return(m):
-            return m.author == target_user and m.content.startswith("!return")
-
-        try:
-            return_msg = await bot.wait_for("message", timeout=60.0, check=check_return)
-        except asyncio.TimeoutError:
-            await message.channel.send("Return trade offer timed out.")
-            return
-
-        # Process return offer
-        return_offer = return_msg.content.replace("!return ", "").strip().split()
-        receiver_cards, receiver_cash_offer = [], 0
-
-        for item in return_offer:
-            if item.startswith("$"):  # If it's cash
-                try:
-                    receiver_cash_offer = int(item[1:])
-                except ValueError:
-                    await message.channel.send("Invalid cash amount in return offer.")
-                    return
-            else:  # Assume it's a card
-                c.execute("""
-                    SELECT cards.player_name, user_cards.instance_number, user_cards.instance_id
-                    FROM user_cards
-                    INNER JOIN cards ON user_cards.card_id = cards.card_id
-                    WHERE user_cards.instance_id = ? AND user_cards.user_id = ?
-                """, (item, receiver_user_id))
-
-                card_row = c.fetchone()
-                if card_row:
-                    receiver_cards.append(f"{card_row[0]} #{card_row[1]} ({item})")  # Format with player_name, instance_number, and instance_id
-                else:
-                    await message.channel.send(f"You do not own the card with Instance ID `{item}`.")
-                    return
-
-        # Check if receiver has enough Court Cash
-        if receiver_cash < receiver_cash_offer:
-            await message.channel.send("You do not have enough Court Cash to make this return offer.")
-            return
-
-        # Final Confirmation
-        receiver_offer_str = ", ".join(receiver_cards) + (f" and ${receiver_cash_offer}" if receiver_cash_offer else "")
-        confirm_msg = await message.channel.send(
-            f"{sender.mention} is offering `{sender_offer_str}`.\n"
-            f"{target_user.mention} is offering `{receiver_offer_str}`.\n"
-            f"Do both players accept?"
-        )
-        await confirm_msg.add_reaction("✅")
-        await confirm_msg.add_reaction("❌")
-
-        def check_final(reaction, user):
-            return user in [sender, target_user] and reaction.message.id == confirm_msg.id and str(reaction.emoji) in ["✅", "❌"]
-
-        accepted_users = set()
-        try:
-            while len(accepted_users) < 2:
-                reaction, user = await bot.wait_for("reaction_add", timeout=60.0, check=check_final)
-                if str(reaction.emoji) == "❌":
-                    await message.channel.send("Trade Offer Declined.")
-                    return
-                accepted_users.add(user)
-        except asyncio.TimeoutError:
-            await message.channel.send("Final trade confirmation timed out.")
-            return
-
-        # Execute the trade
-        # Swap the user_id of the instance_id between both users
-        for sender_instance_id in sender_cards:
-            instance_id = sender_instance_id.split('(')[-1].strip(')')
-            c.execute("UPDATE user_cards SET user_id = ? WHERE instance_id = ?", (receiver_user_id, instance_id))
-        for receiver_instance_id in receiver_cards:
-            instance_id = receiver_instance_id.split('(')[-1].strip(')')
-            c.execute("UPDATE user_cards SET user_id = ? WHERE instance_id = ?", (sender_user_id, instance_id))
-
-        # Exchange Court Cash
-        c.execute("UPDATE users SET court_cash = court_cash - ? WHERE discord_id = ?", (sender_cash_offer, sender_id))
-        c.execute("UPDATE users SET court_cash = court_cash + ? WHERE discord_id = ?", (sender_cash_offer, target_user_id))
-        c.execute("UPDATE users SET court_cash = court_cash - ? WHERE discord_id = ?", (receiver_cash_offer, target_user_id))
-        c.execute("UPDATE users SET court_cash = court_cash + ? WHERE discord_id = ?", (receiver_cash_offer, sender_id))
-        conn.commit()
-
-        await message.channel.send(f"Trade Completed! `{sender_offer_str}` exchanged for `{receiver_offer_str}`.")
+    # Retrieve user IDs & balances from the database
+    sender_row, receiver_row = await db.read(_fetch_user_pair, sender_id, target_user_id)
+
+    if not sender_row or not receiver_row:
+        await message.channel.send("One of the users is not found in the database.")
+        return
+
+    sender_user_id, sender_cash = sender_row
+    receiver_user_id, receiver_cash = receiver_row
+
+    # Parse offer
+    sender_cards, sender_instance_ids, sender_cash_offer, error = await parse_offer(offer, sender_user_id)
+    if error:
+        await message.channel.send(error)
+        return
+
+    # Check if sender has enough Court Cash
+    if sender_cash < sender_cash_offer:
+        await message.channel.send("You do not have enough Court Cash to make this offer.")
+        return
+
+    # Format trade message
+    sender_offer_str = ", ".join(sender_cards) + (f" and ${sender_cash_offer}" if sender_cash_offer else "")
+    trade_msg = await message.channel.send(
+        f"{target_user.mention}, {sender.mention} is offering `{sender_offer_str}`. Do you accept or decline?"
+    )
+    await trade_msg.add_reaction("✅")
+    await trade_msg.add_reaction("❌")
+
+    try:
+        reaction, _ = await interactions.wait_for_reaction(trade_msg, ["✅", "❌"], [target_user])
+    except asyncio.TimeoutError:
+        await message.channel.send("Trade request timed out.")
+        return
+
+    if str(reaction.emoji) == "❌":
+        await message.channel.send("Trade Offer Declined.")
+        return
+
+    await message.channel.send(f"{target_user.mention}, input your return offer using `!return <Cards/Cash>`.")
+
+    try:
+        return_msg = await interactions.wait_for_message(message.channel, [target_user], "!return")
+    except asyncio.TimeoutError:
+        await message.channel.send("Return trade offer timed out.")
+        return
+
+    # Process return offer
+    return_offer = return_msg.content.replace("!return ", "").strip()
+    receiver_cards, receiver_instance_ids, receiver_cash_offer, error = await parse_offer(
+        return_offer, receiver_user_id, "Invalid cash amount in return offer.")
+    if error:
+        await message.channel.send(error)
+        return
+
+    # Check if receiver has enough Court Cash
+    if receiver_cash < receiver_cash_offer:
+        await message.channel.send("You do not have enough Court Cash to make this return offer.")
+        return
+
+    # Final Confirmation
+    receiver_offer_str = ", ".join(receiver_cards) + (f" and ${receiver_cash_offer}" if receiver_cash_offer else "")
+    confirm_msg = await message.channel.send(
+        f"{sender.mention} is offering `{sender_offer_str}`.\n"
+        f"{target_user.mention} is offering `{receiver_offer_str}`.\n"
+        f"Do both players accept?"
+    )
+    await confirm_msg.add_reaction("✅")
+    await confirm_msg.add_reaction("❌")
+
+    try:
+        reactions = await interactions.wait_for_reactions(
+            confirm_msg, ["✅", "❌"], [sender, target_user], stop_emojis=["❌"])
+    except asyncio.TimeoutError:
+        await message.channel.send("Final trade confirmation timed out.")
+        return
+    if "❌" in reactions.values():
+        await message.channel.send("Trade Offer Declined.")
+        return
+
+    # Execute the trade in a single write transaction
+    completed = await db.write(_execute_trade, sender_user_id, sender_instance_ids, sender_cash_offer,
+                               receiver_user_id, receiver_instance_ids, receiver_cash_offer)
+    if not completed:
+        await message.channel.send("Trade cancelled: an offered card or Court Cash was spent before the trade completed.")
+        return
+    invalidate_team(sender_id, target_user_id)
+
+    await message.channel.send(f"Trade Completed! `{sender_offer_str}` exchanged for `{receiver_offer_str}`.")
 
 async def giveaway(message, target_user: discord.Member, giveaway: str, bot: discord.Client):
     # Giveaway a card
@@ -653,87 +728,161 @@ async def giveaway(message, target_user: discord.Member, giveaway: str, bot: dis
     sender_id = sender.id
     target_user_id = target_user.id
 
-    with connect_db() as conn:
-        c = conn.cursor()
-
-        # Retrieve user IDs & balances from the database
-        c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (sender_id,))
-        sender_row = c.fetchone()
-        c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (target_user_id,))
-        receiver_row = c.fetchone()
-
-        if not sender_row or not receiver_row:
-            await message.channel.send("One of the users is not found in the database.")
-            return
-
-        sender_user_id, sender_cash = sender_row
-        receiver_user_id, receiver_cash = receiver_row
-
-        # Parse giveaway details
-        giveaway_details = giveaway.strip().split()
-        sender_cards, sender_cash_giveaway = [], 0
-
-        for item in giveaway_details:
-            if item.startswith("$"):  # If it's cash
-                try:
-                    sender_cash_giveaway = int(item[1:])
-                except ValueError:
-                    await message.channel.send("Invalid cash amount. Please enter a valid number.")
-                    return
-            else:  # Assume it's a card
-                c.execute("""
-                    SELECT cards.player_name, user_cards.instance_number, user_cards.instance_id
-                    FROM user_cards
-                    INNER JOIN cards ON user_cards.card_id = cards.card_id
-                    WHERE user_cards.instance_id = ? AND user_cards.user_id = ?
-                """, (item, sender_user_id))
-
-                card_row = c.fetchone()
-                if card_row:
-                    sender_cards.append(
-                        f"{card_row[0]} #{card_row[1]} ({item})")  # Format with player_name, instance_number, and instance_id
-                else:
-                    await message.channel.send(f"You do not own the card with Instance ID `{item}`.")
-                    return
-
-        # Check if sender has enough Court Cash
-        if sender_cash < sender_cash_giveaway:
-            await message.channel.send("You do not have enough Court Cash to give away.")
-            return
-
-        # Confirm giveaway with the user
-        sender_offer_str = ", ".join(sender_cards) + (f" and ${sender_cash_giveaway}" if sender_cash_giveaway else "")
-        confirm_msg = await message.channel.send(
-            f"{target_user.mention}, {sender.mention} is giving away `{sender_offer_str}`. Do you accept?"
-        )
-        await confirm_msg.add_reaction("✅")
-        await confirm_msg.add_reaction("❌")
+    # Retrieve user IDs & balances from the database
+    sender_row, receiver_row = await db.read(_fetch_user_pair, sender_id, target_user_id)
 
-        def check_reaction(reaction, user):
-            return user == target_user and reaction.message.id == confirm_msg.id and str(reaction.emoji) in ["✅", "❌"]
+    if not sender_row or not receiver_row:
+        await message.channel.send("One of the users is not found in the database.")
+        return
 
-        try:
-            reaction, _ = await bot.wait_for("reaction_add", timeout=60.0, check=check_reaction)
-        except asyncio.TimeoutError:
-            await message.channel.send("Giveaway request timed out.")
-            return
+    sender_user_id, sender_cash = sender_row
+    receiver_user_id, receiver_cash = receiver_row
 
-        if str(reaction.emoji) == "❌":
-            await message.channel.send("Giveaway Declined.")
-            return
+    # Parse giveaway details
+    sender_cards, sender_instance_ids, sender_cash_giveaway, error = await parse_offer(giveaway, sender_user_id)
+    if error:
+        await message.channel.send(error)
+        return
 
-        # Execute the giveaway
-        # Transfer cards
-        for sender_instance_id in sender_cards:
-            instance_id = sender_instance_id.split('(')[-1].strip(')')
-            c.execute("UPDATE user_cards SET user_id = ? WHERE instance_id = ?", (receiver_user_id, instance_id))
+    # Check if sender has enough Court Cash
+    if sender_cash < sender_cash_giveaway:
+        await message.channel.send("You do not have enough Court Cash to give away.")
+        return
 
-        # Transfer Court Cash
-        c.execute("UPDATE users SET court_cash = court_cash - ? WHERE discord_id = ?",
-                  (sender_cash_giveaway, sender_id))
-        c.execute("UPDATE users SET court_cash = court_cash + ? WHERE discord_id = ?",
-                  (sender_cash_giveaway, target_user_id))
+    # Confirm giveaway with the user
+    sender_offer_str = ", ".join(sender_cards) + (f" and ${sender_cash_giveaway}" if sender_cash_giveaway else "")
+    confirm_msg = await message.channel.send(
+        f"{target_user.mention}, {sender.mention} is giving away `{sender_offer_str}`. Do you accept?"
+    )
+    await confirm_msg.add_reaction("✅")
+    await confirm_msg.add_reaction("❌")
 
-        conn.commit()
+    try:
+        reaction, _ = await interactions.wait_for_reaction(confirm_msg, ["✅", "❌"], [target_user])
+    except asyncio.TimeoutError:
+        await message.channel.send("Giveaway request timed out.")
+        return
 
-        await message.channel.send(f"Giveaway Completed! `{sender_offer_str}` has been given to {target_user.mention}.")
+    if str(reaction.emoji) == "❌":
+        await message.channel.send("Giveaway Declined.")
+        return
+
+    # Execute the giveaway. A giveaway is a one-sided trade.
+    completed = await db.write(_execute_trade, sender_user_id, sender_instance_ids, sender_cash_giveaway,
+                               receiver_user_id, [], 0)
+    if not completed:
+        await message.channel.send("Giveaway cancelled: a card or Court Cash was spent before the giveaway completed.")
+        return
+    invalidate_team(sender_id, target_user_id)
+
+    await message.channel.send(f"Giveaway Completed! `{sender_offer_str}` has been given to {target_user.mention}.")
+
+
+def _fetch_user_pair(conn, sender_id, target_user_id):
+    # Returns the (user_id, court_cash) rows of both sides of a trade or giveaway
+    c = conn.cursor()
+    c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (sender_id,))
+    sender_row = c.fetchone()
+    c.execute("SELECT user_id, court_cash FROM users WHERE discord_id = ?", (target_user_id,))
+    receiver_row = c.fetchone()
+    return sender_row, receiver_row
+
+
+async def parse_offer(offer, owner_user_id, cash_error="Invalid cash amount. Please enter a valid number."):
+    # Parses "<instance_id> ... $<cash>" into display strings, instance IDs and a cash amount.
+    # Returns (cards, instance_ids, cash, error) where error is a message to send back, or None.
+    return await db.read(_parse_offer, offer, owner_user_id, cash_error)
+
+
+def _parse_offer(conn, offer, owner_user_id, cash_error):
+    cards, instance_ids, cash = [], [], 0
+    c = conn.cursor()
+
+    for item in offer.strip().split():
+        if item.startswith("$"):  # If it's cash
+            try:
+                cash = int(item[1:])
+            except ValueError:
+                return cards, instance_ids, cash, cash_error
+            if cash <= 0:
+                return cards, instance_ids, 0, "Cash amounts must be more than $0."
+        elif item in instance_ids:  # Listing a card twice still offers it once
+            continue
+        else:  # Assume it's a card
+            c.execute("""
+                SELECT cards.player_name, user_cards.instance_number, user_cards.instance_id
+                FROM user_cards
+                INNER JOIN cards ON user_cards.card_id = cards.card_id
+                WHERE user_cards.instance_id = ? AND user_cards.user_id = ?
+            """, (item, owner_user_id))
+
+            card_row = c.fetchone()
+            if card_row:
+                cards.append(f"{card_row[0]} #{card_row[1]} ({item})")  # Format with player_name, instance_number, and instance_id
+                instance_ids.append(item)
+            else:
+                return cards, instance_ids, cash, f"You do not own the card with Instance ID `{item}`."
+
+    return cards, instance_ids, cash, None
+
+
+def _owns_instances(c, owner_user_id, instance_ids):
+    # True if every instance ID still belongs to owner_user_id
+    if not instance_ids:
+        return True
+    placeholders = ", ".join("?" for _ in instance_ids)
+    c.execute(f"SELECT COUNT(*) FROM user_cards WHERE user_id = ? AND instance_id IN ({placeholders})",
+              (owner_user_id, *instance_ids))
+    return c.fetchone()[0] == len(set(instance_ids))
+
+
+def _execute_trade(conn, sender_user_id, sender_instance_ids, sender_cash,
+                   receiver_user_id, receiver_instance_ids, receiver_cash):
+    # Swaps cards and Court Cash between two users. The cards and balances are re-checked here
+    # because either player may have spent them while the trade was waiting on reactions.
+    # Returns False, having changed nothing, if so.
+    c = conn.cursor()
+    if not (_owns_instances(c, sender_user_id, sender_instance_ids) and
+            _owns_instances(c, receiver_user_id, receiver_instance_ids)):
+        return False
+
+    # Take each side's Court Cash first, only if they still have it
+    if not _debit_cash(c, sender_user_id, sender_cash):
+        return False
+    if not _debit_cash(c, receiver_user_id, receiver_cash):
+        c.execute("UPDATE users SET court_cash = court_cash + ? WHERE user_id = ?", (sender_cash, sender_user_id))
+        return False
+
+    # Swap the user_id of the instance_id between both users
+    _move_instances(c, sender_instance_ids, sender_user_id, receiver_user_id)
+    _move_instances(c, receiver_instance_ids, receiver_user_id, sender_user_id)
+    refresh_team_ratings(c, (sender_user_id, receiver_user_id))  # A traded card may leave a lineup
+
+    # Hand over the Court Cash taken above
+    c.execute("UPDATE users SET court_cash = court_cash + ? WHERE user_id = ?", (sender_cash, receiver_user_id))
+    c.execute("UPDATE users SET court_cash = court_cash + ? WHERE user_id = ?", (receiver_cash, sender_user_id))
+    return True
+
+
+def _debit_cash(c, user_id, amount):
+    # Takes amount from user_id's Court Cash. Returns False, leaving it alone, if they have less
+    # or amount is negative.
+    if amount < 0:
+        return False
+    if not amount:
+        return True
+    c.execute("UPDATE users SET court_cash = court_cash - ? WHERE user_id = ? AND court_cash >= ?",
+              (amount, user_id, amount))
+    return c.rowcount == 1
+
+
+def _move_instances(c, instance_ids, from_user_id, to_user_id):
+    # Only counts a card as moved if from_user_id still held it, so a repeated ID can't be counted twice
+    for instance_id in instance_ids:
+        c.execute("SELECT card_id, condition FROM user_cards WHERE instance_id = ?", (instance_id,))
+        card_id, condition = c.fetchone()
+        c.execute("UPDATE user_cards SET user_id = ? WHERE instance_id = ? AND user_id = ?",
+                  (to_user_id, instance_id, from_user_id))
+        if c.rowcount == 1:
+            count_cards(c, from_user_id, card_id, condition, -1)
+            count_cards(c, to_user_id, card_id, condition, 1)
@@ -1,9 +1,78 @@
 #player_cards.py
-from PIL import Image
+import os, json, pickle, hashlib, ntpath, unicodedata
+from typing import NamedTuple
+
+# The card catalog lives in a JSON manifest next to this file. Each entry has the PlayerCard fields,
+# with "image" being a file name inside CARD_IMAGE_DIR. Set HOPS_CARD_IMAGE_DIR to keep the images
+# elsewhere; by default they are in a cards directory next to this file.
+CARD_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'player_cards.json')
+CARD_CACHE = CARD_MANIFEST[:-len('.json')] + '.cache'  # Compiled form of the manifest, rebuilt when it changes
+CARD_CACHE_VERSION = 1  # Bump when the record layout changes
+CARD_IMAGE_DIR = os.environ.get('HOPS_CARD_IMAGE_DIR') or os.path.join(os.path.dirname(CARD_MANIFEST), 'cards')
+MANIFEST_FIELDS = ("card_id", "player_name", "position", "season_year", "stats",
+                   "offensive_rating", "defensive_rating", "attributes", "image")
+
+
+def normalize_name(player_name):
+    # Lookup key for a player name: ignores case, accents and extra whitespace,
+    # so "nikola jokic" finds "Nikola Jokić"
+    name = unicodedata.normalize('NFKD', str(player_name))
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    return ' '.join(name.casefold().split())
+
+
+class CatalogIndex(NamedTuple):
+    cards: tuple
+    by_id: dict  # card_id -> card
+    by_name: dict  # normalized name -> cards of that player, in catalog order
+    by_name_season: dict  # (normalized name, season_year) -> card
+
+
+class CardCatalog:
+    # O(1) card lookups by id, by player name and by (name, season). The indexes are built in one
+    # go and swapped in with a single assignment, so readers always see a complete catalog.
+
+    def __init__(self):
+        self.index = self.build_index(())
+
+    @staticmethod
+    def build_index(cards):
+        by_id, by_name, by_name_season = {}, {}, {}
+        for card in cards:
+            key = normalize_name(card.player_name)
+            by_id[card.card_id] = card
+            by_name.setdefault(key, []).append(card)
+            by_name_season[(key, str(card.season_year))] = card
+        by_name = {key: tuple(name_cards) for key, name_cards in by_name.items()}
+        return CatalogIndex(tuple(cards), by_id, by_name, by_name_season)
+
+    def rebuild(self, cards):
+        self.index = self.build_index(cards)
+
+    def by_id(self, card_id):
+        return self.index.by_id.get(card_id)
+
+    def by_name(self, player_name):
+        # First card for the player in catalog order, or None
+        cards = self.index.by_name.get(normalize_name(player_name))
+        return cards[0] if cards else None
+
+    def all_by_name(self, player_name):
+        # Every season of the player
+        return self.index.by_name.get(normalize_name(player_name), ())
+
+    def by_name_season(self, player_name, season_year):
+        return self.index.by_name_season.get((normalize_name(player_name), str(season_year)))
+
+    def __len__(self):
+        return len(self.index.cards)
+
+
+catalog = CardCatalog()
 
 
 class PlayerCard:
-    cards = []  # Stores all cards on initialization
+    cards = []  # Stores all cards on initialization, see install_cards()
 
     def __init__(self, card_id, player_name, position, season_year, stats, offensive_rating, defensive_rating, attributes, image_path):
         self.card_id = card_id
@@ -14,292 +83,87 @@ class PlayerCard:
         self.offensive_rating = offensive_rating
         self.defensive_rating = defensive_rating
         self.attributes = attributes
-
-        # Loads the image
-        try:
-            self.image = Image.open(image_path) # Resize the image
-            self.image = self.image.resize((200, 300))
-            print(f"Image loaded successfully: {image_path}")
-        except Exception as e:
-            print(f"Error loading image: {e}")
-            self.image = None  # Set image to None if loading fails
-
-        PlayerCard.cards.append(self) # Add this card to the list of created cards
+        self.image_path = image_path  # Opened and decoded by the render workers, see HOPS_images
+        self.image_version = image_version(image_path)  # Lets a reload spot art replaced in place
 
     @classmethod
     def get_cards(cls): # return full list of cards
         return cls.cards
 
-    # player_cards.py
     @classmethod
     def get_card_by_name(cls, player_name):
-        try:
-            # Assuming the cards are stored in a list or database query
-            for card in cls.cards:  # Adjust as needed for your card storage
-                if card.get('player_name', '').lower() == player_name.lower():
-                    return PlayerCard(card['player_name'], card['stats'])
-            return None
-        except Exception as e:
-            print(f"Error retrieving card by player name: {e}")
-            return None
+        """Retrieve a card by its player's name."""
+        return catalog.by_name(player_name)
 
     @classmethod
     def get_card_by_id(cls, card_id):
         """Retrieve a card by its ID."""
-        for card in cls.cards:
-            if card['id'] == card_id:
-                return card
+        return catalog.by_id(card_id)
+
+def image_version(path):
+    # The image file's mtime, or None if it is missing
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
         return None
 
-def initialize_player_cards():
-    lebron_13 = PlayerCard(
-        card_id=1,
-        player_name="LeBron James",
-        position = "Point Guard, Shooting Guard, Small Forward, Power Forward, Center",
-        season_year="2012-2013",
-        stats="PPG:26.8, RPG:8.0, APG:7.3, BPG:0.9, SPG:1.7",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\lebron13.png"
-    )
-
-    kd_14 = PlayerCard(
-        card_id=2,
-        player_name="Kevin Durant",
-        position="Small Forward, Power Forward",
-        season_year="2013-2014",
-        stats="PPG:32.0, RPG:7.4, APG:5.5, BPG:0.7, SPG:1.3",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\kd14.png"
-    )
-
-    curry_16 = PlayerCard(
-        card_id=3,
-        player_name="Stephen Curry",
-        position="Point Guard, Shooting Guard",
-        season_year="2015-2016",
-        stats="PPG:30.1, RPG:5.4, APG:6.7, BPG:0.2, SPG:2.1",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\curry16.png"
-    )
-
-    westbrook_17 = PlayerCard(
-        card_id=4,
-        player_name="Russell Westbrook",
-        position="Point Guard, Shooting Guard",
-        season_year="2016-2017",
-        stats="PPG:31.6, RPG:10.7, APG:10.4, BPG:0.4, SPG:1.6",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\westbrook17.png"
-    )
-
-    kobe_06 = PlayerCard(
-        card_id=5,
-        player_name="Kobe Bryant",
-        position="Shooting Guard, Small Forward",
-        season_year="2005-2006",
-        stats="PPG:35.4, RPG:5.3, APG:4.5, BPG:0.4, SPG:1.8",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\kobe06.png"
-    )
-
-    mj_96 = PlayerCard(
-        card_id=6,
-        player_name="Michael Jordan",
-        position="Shooting Guard, Small Forward",
-        season_year="1995-1996",
-        stats="PPG:30.4, RPG:6.6, APG:4.3, BPG:0.5, SPG:2.2",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\mj96.png"
-    )
-
-    shaq_01 = PlayerCard(
-        card_id=7,
-        player_name="Shaquille O'Neal",
-        position="Power Forward, Center",
-        season_year="2000-2001",
-        stats="PPG:28.7, RPG:12.7, APG:3.7, BPG:2.8, SPG:0.6",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\shaq01.png"
-    )
-
-    duncan_03 = PlayerCard(
-        card_id=8,
-        player_name="Tim Duncan",
-        position="Power Forward, Center",
-        season_year="2002-2003",
-        stats="PPG:23.3, RPG:12.9, APG:3.9, BPG:2.9, SPG:0.7",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\duncan03.png"
-    )
-
-    garnett_04 = PlayerCard(
-        card_id=9,
-        player_name="Kevin Garnett",
-        position="Small Forward, Power Forward, Center",
-        season_year="2003-2004",
-        stats="PPG:24.2, RPG:13.9, APG:5.0, BPG:2.2, SPG:1.5",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\garnett04.png"
-    )
-
-    harden_18 = PlayerCard(
-        card_id=10,
-        player_name="James Harden",
-        position="Point Guard, Shooting Guard",
-        season_year="2017-2018",
-        stats="PPG:30.4, RPG:5.4, APG:8.8, BPG:0.7, SPG:1.8",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\harden18.png"
-    )
-
-    giannis_20 = PlayerCard(
-        card_id=11,
-        player_name="Giannis Antetokounmpo",
-        position="Power Forward, Center",
-        season_year="2019-2020",
-        stats="PPG:29.5, RPG:13.6, APG:5.6, BPG:1.0, SPG:1.0",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\giannis20.png"
-    )
-
-    bird_86 = PlayerCard(
-        card_id=12,
-        player_name="Larry Bird",
-        position="Small Forward, Power Forward",
-        season_year="1985-1986",
-        stats="PPG:25.8, RPG:9.8, APG:6.8, BPG:0.6, SPG:2.0",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\bird86.png"
-    )
-
-    magic_87 = PlayerCard(
-        card_id=13,
-        player_name="Magic Johnson",
-        position="Point Guard, Power Forward, Center",
-        season_year="1986-1987",
-        stats="PPG:23.9, RPG:6.3, APG:12.2, BPG:0.5, SPG:1.7",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\magic87.png"
-    )
-
-    dirk_11 = PlayerCard(
-        card_id=14,
-        player_name="Dirk Nowitzki",
-        position="Power Forward, Center",
-        season_year="2010-2011",
-        stats="PPG:23.0, RPG:7.0, APG:2.6, BPG:0.6, SPG:0.5",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\dirk11.png"
-    )
-
-    ai_01 = PlayerCard(
-        card_id=15,
-        player_name="Allen Iverson",
-        position="Point Guard, Shooting Guard",
-        season_year="2000-2001",
-        stats="PPG:31.1, RPG:3.8, APG:4.6, BPG:0.3, SPG:2.5",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\ai01.png"
-    )
-
-    cp3_14 = PlayerCard(
-        card_id=16,
-        player_name="Chris Paul",
-        position="Point Guard",
-        season_year="2013-2014",
-        stats="PPG:19.1, RPG:4.3, APG:10.7, BPG:0.1, SPG:2.5",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\cp3_14.png"
-    )
-
-    kawhi_15 = PlayerCard(
-        card_id=17,
-        player_name="Kawhi Leonard",
-        position="Small Forward, Power Foward",
-        season_year="2014-2015",
-        stats="PPG:16.5, RPG:7.2, APG:2.5, BPG:0.8, SPG:2.3",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\kawhi15.png"
-    )
-
-    nash_06 = PlayerCard(
-        card_id=18,
-        player_name="Steve Nash",
-        position="Point Guard",
-        season_year="2005-2006",
-        stats="PPG:18.8, RPG:4.2, APG:10.5, BPG:0.2, SPG:0.8",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\nash06.png"
-    )
-
-    davis_20 = PlayerCard(
-        card_id=19,
-        player_name="Anthony Davis",
-        position="Power Forward, Center",
-        season_year="2019-2020",
-        stats="PPG:26.1, RPG:9.3, APG:3.2, BPG:2.3, SPG:1.5",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\davis20.png"
-    )
-
-    embiid_22 = PlayerCard(
-        card_id=20,
-        player_name="Joel Embiid",
-        position="Power Forward, Center",
-        season_year="2021-2022",
-        stats="PPG:30.6, RPG:11.7, APG:4.2, BPG:1.5, SPG:1.1",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\embiid22.png"
-    )
-
-    jokic_21 = PlayerCard(
-        card_id=21,
-        player_name="Nikola Jokić",
-        position="Power Forward, Center",
-        season_year="2020-2021",
-        stats="PPG:26.4, RPG:10.8, APG:8.3, BPG:0.7, SPG:1.3",
-        offensive_rating=94,
-        defensive_rating=90,
-        attributes=['x'],
-        image_path=r"C:\Users\brace\Downloads\cards\jokic21.png"
-    )
+
+def card_image_path(image):
+    # Manifest images are file names inside CARD_IMAGE_DIR, unless they are absolute paths
+    return image if os.path.isabs(image) or ntpath.isabs(image) else os.path.join(CARD_IMAGE_DIR, image)
+
+
+def parse_manifest(raw):
+    # Turns the manifest JSON into compact record tuples in PlayerCard argument order
+    return [
+        tuple(entry[field] for field in MANIFEST_FIELDS[:-1]) + (card_image_path(entry["image"]),)
+        for entry in json.loads(raw)
+    ]
+
+
+def load_card_records(manifest_path=CARD_MANIFEST, cache_path=CARD_CACHE):
+    # Returns the catalog records. The parsed manifest is pickled to cache_path along with the
+    # manifest's mtime, size and hash, so a normal boot is one read of the cache file. If only the
+    # mtime changed (e.g. a fresh checkout) the hash still matches and the JSON is not re-parsed.
+    # Records hold full image paths, so the cache is also rebuilt when CARD_IMAGE_DIR changes.
+    stat = os.stat(manifest_path)
+    cache = None
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if (cache["version"] == CARD_CACHE_VERSION and cache["image_dir"] == CARD_IMAGE_DIR
+                and (cache["mtime_ns"], cache["size"]) == (stat.st_mtime_ns, stat.st_size)):
+            return cache["records"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError, AttributeError):
+        cache = None
+
+    with open(manifest_path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if (cache is not None and cache.get("version") == CARD_CACHE_VERSION
+            and cache.get("image_dir") == CARD_IMAGE_DIR and cache.get("sha256") == digest):
+        records = cache["records"]
+    else:
+        records = parse_manifest(raw)
+
+    try:
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"version": CARD_CACHE_VERSION, "image_dir": CARD_IMAGE_DIR, "mtime_ns": stat.st_mtime_ns,
+                         "size": stat.st_size, "sha256": digest, "records": records}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)  # Never leave a half-written cache behind
+    except OSError as e:
+        print(f"Could not write card cache: {e}")
+
+    return records
+
+
+def install_cards(cards):
+    # Makes cards the live catalog
+    PlayerCard.cards = list(cards)
+    catalog.rebuild(PlayerCard.cards)
+
+
+def initialize_player_cards(manifest_path=CARD_MANIFEST, cache_path=CARD_CACHE):
+    # Loads every card from the manifest (see load_card_records) and installs them
+    install_cards([PlayerCard(*record) for record in load_card_records(manifest_path, cache_path)])